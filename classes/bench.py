@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import contextlib
+import subprocess
+import importlib.util
+
+import loggen
+
+here = os.path.dirname(os.path.abspath(__file__))
+logs_script = os.path.join(here, '..', 'logs', 'logs.py')
+
+
+def load_logs():
+    """Модуль logs/logs.py без запуска его main"""
+    spec = importlib.util.spec_from_file_location('logs', logs_script)
+    logs = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(logs)
+    return logs
+
+
+def run_stages(impl, path):
+    """Выполняется в дочернем процессе: разбирает `path` реализацией `impl`
+    и возвращает время этапов: чтения файла (у add_from_archive и parallel
+    оно входит в разбор), разбора строк и подсчёта результатов"""
+    from hw5_stripped import LogStat
+    import parallel
+
+    if impl == 'logs':
+        logs = load_logs()
+    stages = {}
+    start = time.perf_counter()
+    if impl in ('logs', 'add_line'):
+        with open(path) as f:
+            lines = f.readlines()
+    elif impl == 'add_from_file':
+        with open(path, 'rb') as f:
+            data = f.read()
+    read = time.perf_counter()
+    if impl in ('logs', 'add_line', 'add_from_file'):
+        stages['read'] = read - start
+
+    if impl == 'logs':
+        class Stat(logs.LogStat):
+            def results(self):
+                pass  # logs.LogStat() сразу читает stdin в results()
+
+        stat = Stat()
+        parse = stat._parse_line
+        for line in lines:
+            parse(line[:-1])
+    elif impl == 'parallel':
+        stat = parallel.parallel_stat(path)
+    else:
+        stat = LogStat()
+        if impl == 'add_line':
+            for line in lines:
+                stat.add_line(line)
+        elif impl == 'add_from_file':
+            stat.add_from_buffer(data)
+        else:
+            stat.add_from_archive(path)
+    parsed = time.perf_counter()
+    stages['parse'] = parsed - read
+
+    if impl == 'logs':
+        sys.stdin = io.StringIO()
+        with contextlib.redirect_stdout(io.StringIO()):
+            logs.LogStat.results(stat)
+    else:
+        stat.results()
+    stages['results'] = time.perf_counter() - parsed
+    return stages
+
+
+def measure(impl, path, lines):
+    command = [sys.executable, os.path.abspath(__file__), '--run', impl,
+               path]
+
+    start = time.perf_counter()
+    child = subprocess.Popen(command, stdin=subprocess.DEVNULL,
+                             stdout=subprocess.PIPE, cwd=here)
+    output = child.stdout.read()
+    _, status, usage = os.wait4(child.pid, 0)
+    total = time.perf_counter() - start
+    if status:
+        raise RuntimeError('{0} failed with status {1}'.format(impl, status))
+
+    stages = json.loads(output)
+    stages['total'] = total
+    return {
+        'impl': impl,
+        'lines_per_sec': lines / total,
+        'peak_rss_kb': usage.ru_maxrss,
+        'stages': stages
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Бенчмарк logs/logs.py и classes/hw5_stripped.py')
+    parser.add_argument('--lines', type=int, default=200000)
+    parser.add_argument('--pages', type=int, default=1000)
+    parser.add_argument('--clients', type=int, default=100)
+    parser.add_argument('--agents', type=int, default=20)
+    parser.add_argument('--malformed', type=float, default=0.01)
+    parser.add_argument('--no-req-time', type=float, default=0.1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--impl', action='append',
+                        choices=['logs', 'add_line', 'add_from_file',
+                                 'add_from_archive', 'parallel'])
+    parser.add_argument('--out', default='bench.json')
+    parser.add_argument('--run', nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        print(json.dumps(run_stages(*args.run)))
+        return
+
+    params = {key: getattr(args, key) for key in (
+        'lines', 'pages', 'clients', 'agents', 'malformed', 'no_req_time',
+        'seed')}
+    report = {
+        'params': params,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'results': []
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'access.log')
+        start = time.perf_counter()
+        with open(path, 'w') as f:
+            f.writelines(loggen.generate(**params))
+        report['generate'] = time.perf_counter() - start
+
+        for impl in args.impl or ['logs', 'add_line', 'add_from_file']:
+            result = measure(impl, path, args.lines)
+            report['results'].append(result)
+            print('{impl:16} {lines_per_sec:10.0f} lines/s '
+                  '{peak_rss_kb:8} KB'.format(**result))
+
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
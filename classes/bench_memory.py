@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+import sys
+import gc
+import tracemalloc
+
+import hw5_stripped
+
+
+class DictPage(hw5_stripped.Page):
+    """Страница с `__dict__`, как до перехода на `__slots__`"""
+
+
+def make_lines(pages, clients, days):
+    for i in range(pages):
+        client = i % clients
+        yield '192.168.{0}.{1} - - [{2:02}/Feb/2013:06:37:21 +0600] "GET ' \
+              '/page/{3}?id={4} HTTP/1.1" 200 1047 "-" "Mozilla/5.0 ' \
+              '(Agent {5})" {6}\n'.format(client // 256, client % 256,
+                                          i % days + 1, i, i * 7, i % 10,
+                                          i % 1000 + 1)
+
+
+def measure(page_class, intern, pages, clients, days):
+    """Память LogStat после `pages` строк со страницами `page_class` и
+    функцией `intern` для имён клиентов"""
+    class Stat(hw5_stripped.LogStat):
+        pass
+    Stat.page_class = page_class
+    Stat.intern = staticmethod(intern)
+
+    lines = list(make_lines(pages, clients, days))
+    gc.collect()
+    tracemalloc.start()
+    try:
+        stat = Stat()
+        for line in lines:
+            stat.add_line(line)
+        gc.collect()
+        size = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return size
+
+
+if __name__ == '__main__':
+    pages = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    clients = pages // 10
+    days = 28
+    print('{0} distinct pages, {1} clients, {2} days'.format(
+        pages, clients, days))
+    Page = hw5_stripped.Page
+    for title, page_class, intern in (('__dict__ pages', DictPage, str),
+                                      ('__slots__ pages', Page, str),
+                                      ('__slots__ + intern', Page,
+                                       sys.intern)):
+        size = measure(page_class, intern, pages, clients, days)
+        print('{0:20} {1:8.1f} bytes per distinct page'.format(
+            title, size / pages))
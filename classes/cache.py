@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+import os
+import mmap
+import pickle
+import pprint
+import hashlib
+import argparse
+
+from hw5_stripped import LogStat
+from normalize import Normalizer
+
+
+def option_key(value):
+    """Значение параметра LogStat для ключа записи: одинаковое для равных
+    параметров в разных запусках (без адресов объектов и порядка множеств)"""
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, Normalizer):
+        return ('Normalizer', option_key(value.keep),
+                option_key(value.prefixes), value.collapse)
+    if isinstance(value, (set, frozenset)):
+        return ('set', sorted(map(option_key, value), key=repr))
+    if isinstance(value, (list, tuple)):
+        return tuple(map(option_key, value))
+    if isinstance(value, dict):
+        return ('dict', sorted((option_key(key), option_key(item))
+                               for key, item in value.items()))
+    raise ValueError('ResultCache does not support option value ' +
+                     repr(value))
+
+
+class ResultCache:
+    """Результаты LogStat по файлам логов в каталоге `directory`.
+
+    Запись о файле хранит его отпечаток: (st_dev, st_ino), размер, mtime и
+    хэш первых `head_size` байт, - а также результаты и состояние
+    статистики (`LogStat.dump`) по полным строкам. Если отпечаток не
+    изменился, результаты возвращаются без разбора. Если файл тот же и
+    только дописан (начало совпадает, размер не меньше), состояние
+    загружается и разбирается только дописанный конец. Иначе файл
+    разбирается заново. `options` - параметры LogStat"""
+    head_size = 4096
+
+    def __init__(self, directory, **options):
+        if options.get('spill'):
+            raise ValueError('ResultCache does not support spill')
+        self.directory = directory
+        self.options = options
+        self._key = option_key(options)
+        os.makedirs(directory, exist_ok=True)
+
+    def entry_path(self, path):
+        """Файл записи: по абсолютному пути лога и параметрам статистики"""
+        key = repr((os.path.abspath(path), self._key))
+        return os.path.join(self.directory, hashlib.sha256(
+            key.encode('utf-8', 'surrogateescape')).hexdigest())
+
+    def results(self, path):
+        """Результаты `LogStat.results()` по файлу `path`"""
+        entry = self._read_entry(path)
+        with open(path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            head = f.read(self.head_size)
+            fingerprint = {
+                'inode': (st.st_dev, st.st_ino),
+                'size': st.st_size,
+                'mtime': st.st_mtime_ns,
+                'head': hashlib.sha256(head).hexdigest()
+            }
+            if entry is not None and entry['fingerprint'] == fingerprint:
+                return entry['results']
+            if st.st_size == 0:
+                raise ValueError('Empty log: ' + path)
+
+            if entry is not None and self._is_appended(entry, st, head):
+                stat = LogStat.load(entry['stat'])
+                offset = entry['offset']  # конец последней полной строки
+            else:
+                stat = LogStat(**self.options)
+                offset = 0
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                end = buf.rfind(b'\n', offset) + 1 or offset
+                stat.add_from_buffer(buf, offset, end)
+                state = stat.dump()
+                # незаконченная последняя строка учитывается в результатах,
+                # но не в состоянии: её допишут
+                stat.add_from_buffer(buf, end, st.st_size)
+
+        if stat._is_empty():
+            raise ValueError('No log lines in ' + path)
+        results = stat.results()
+        # начало файла в пределах состояния - для проверки, что файл дописан
+        head_size = min(len(head), end)
+        self._write_entry(path, {
+            'fingerprint': fingerprint,
+            'offset': end,
+            'head_size': head_size,
+            'head': hashlib.sha256(head[:head_size]).hexdigest(),
+            'stat': state,
+            'results': results
+        })
+        return results
+
+    @staticmethod
+    def _is_appended(entry, st, head):
+        fingerprint = entry['fingerprint']
+        return fingerprint['inode'] == (st.st_dev, st.st_ino) and \
+            st.st_size >= fingerprint['size'] and \
+            entry['head'] == hashlib.sha256(
+                head[:entry['head_size']]).hexdigest()
+
+    def _read_entry(self, path):
+        try:
+            with open(self.entry_path(path), 'rb') as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _write_entry(self, path, entry):
+        entry_path = self.entry_path(path)
+        tmp = entry_path + '.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump(entry, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, entry_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Результаты LogStat по файлам логов с кэшем: '
+                    'неизменённые файлы не разбираются, у дописанных '
+                    'разбирается только конец')
+    parser.add_argument('directory', help='каталог кэша')
+    parser.add_argument('logs', nargs='+')
+    parser.add_argument('--top', type=int, default=1)
+    args = parser.parse_args()
+
+    cache = ResultCache(args.directory, top=args.top)
+    for path in args.logs:
+        pprint.pprint(cache.results(path))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+import sys
+import mmap
+import array
+import pprint
+import struct
+import datetime
+from collections import Counter
+from itertools import compress
+
+from hw5_stripped import LogStat, bytes_pattern, field_names, \
+    line_spans, req_time_value
+from quantiles import QuantileSketch
+from hll import HyperLogLog
+from compressed import decompressed_blocks
+
+magic = b'LOGCOL1' + (b'<' if sys.byteorder == 'little' else b'>')
+header = struct.Struct('=8sQ')
+section = struct.Struct('=QQQ')  # смещение, длина в байтах, элементов
+
+epoch = datetime.date(1970, 1, 1).toordinal()
+has_req_time = 1
+has_minute = 2
+
+# (имя, тип array) в порядке записи в файл
+columns = (('time', 'q'), ('day', 'I'), ('page', 'I'), ('ip', 'I'),
+           ('agent', 'I'), ('code', 'I'), ('req_time', 'q'), ('flags', 'B'))
+tables = ('days', 'pages', 'ips', 'agents', 'codes')
+
+
+class ColumnWriter:
+    """Разбирает строки лога и складывает поля по столбцам: время как int64
+    секунд местного времени с 1970 года, страницы, клиенты, браузеры, коды и
+    дни как номера в словарях, время обработки с битом наличия в `flags`"""
+
+    def __init__(self):
+        self.columns = {name: array.array(typecode)
+                        for name, typecode in columns}
+        self.tables = {name: {} for name in tables}  # {bytes: id, ...}
+        self._dates = {}  # {время: (id дня, секунды начала дня), ...}
+        self._clocks = {}  # {часы: (секунды с начала дня, флаги), ...}
+
+    def _encode(self, table, value):
+        ids = self.tables[table]
+        if value not in ids:
+            ids[value] = len(ids)
+        return ids[value]
+
+    def _date(self, time):
+        date = LogStat._get_date(time.decode('ascii'))
+        day = self._encode('days', str(date.toordinal()).encode())
+        return day, (date.toordinal() - epoch) * 86400
+
+    @staticmethod
+    def _clock(clock):
+        # минута разбирается так же, как в Rollup
+        try:
+            datetime.time(int(clock[:2]), int(clock[3:5]))
+        except ValueError:
+            return 0, 0
+        seconds = int(clock[:2]) * 3600 + int(clock[3:5]) * 60
+        if clock[6:8].isdigit() and int(clock[6:8]) < 60:
+            seconds += int(clock[6:8])
+        return seconds, has_minute
+
+    def add_from_buffer(self, buf, start=0, end=None):
+        """Разбирает строки буфера так же, как `LogStat.add_from_buffer`"""
+        cols = self.columns
+        dates = self._dates
+        clocks = self._clocks
+        encode = self._encode
+        match = bytes_pattern.match
+        for pos, eol in line_spans(buf, start, end):
+            log = match(buf, pos, eol)
+            if not log:
+                continue
+
+            ip, time, clock, name, code, agent, req_time = log.group(
+                *field_names)
+            if time not in dates:
+                dates[time] = self._date(time)
+            if clock not in clocks:
+                clocks[clock] = self._clock(clock)
+            day, midnight = dates[time]
+            seconds, flags = clocks[clock]
+            value = req_time_value(req_time)
+            if value == -1:
+                value = 0
+            else:
+                flags |= has_req_time
+
+            cols['time'].append(midnight + seconds)
+            cols['day'].append(day)
+            cols['page'].append(encode('pages', name))
+            cols['ip'].append(encode('ips', ip))
+            cols['agent'].append(encode('agents', agent))
+            cols['code'].append(encode('codes', code))
+            cols['req_time'].append(value)
+            cols['flags'].append(flags)
+
+    def add_from_archive(self, path, processes=None):
+        rest = b''
+        for block in decompressed_blocks(path, processes):
+            data = rest + block
+            end = data.rfind(b'\n') + 1
+            self.add_from_buffer(data, 0, end)
+            rest = data[end:]
+        if rest:
+            self.add_from_buffer(rest)
+
+    def save(self, path):
+        blobs = [self.columns[name].tobytes() for name, _ in columns]
+        counts = [len(self.columns[name]) for name, _ in columns]
+        for name in tables:
+            blobs.append(b'\n'.join(self.tables[name]))
+            counts.append(len(self.tables[name]))
+
+        offset = header.size + section.size * len(blobs)
+        sections = []
+        for blob, count in zip(blobs, counts):
+            offset += -offset % 8
+            sections.append(section.pack(offset, len(blob), count))
+            offset += len(blob)
+
+        with open(path, 'wb') as f:
+            f.write(header.pack(magic, len(self.columns['time'])))
+            f.write(b''.join(sections))
+            for blob in blobs:
+                f.write(b'\0' * (-f.tell() % 8))
+                f.write(blob)
+
+
+def convert(source, path, processes=None):
+    """Разбирает лог `source` (можно сжатый) и сохраняет столбцы в `path`"""
+    writer = ColumnWriter()
+    writer.add_from_archive(source, processes)
+    writer.save(path)
+
+
+class Columns:
+    """Столбцы файла, созданного `convert`, отображённые в память"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._map)
+        file_magic, self.rows = header.unpack_from(view)
+        if file_magic != magic:
+            raise ValueError('Not a column file: ' + path)
+
+        self._views = [view]
+        pos = header.size
+        for name, typecode in columns:
+            offset, size, _ = section.unpack_from(view, pos)
+            pos += section.size
+            column = view[offset:offset + size].cast(typecode)
+            self._views.append(column)
+            setattr(self, name, column)
+        for name in tables:
+            offset, size, count = section.unpack_from(view, pos)
+            pos += section.size
+            values = bytes(view[offset:offset + size]).split(b'\n')
+            setattr(self, name, [value.decode('utf-8', 'surrogateescape')
+                                 for value in values] if count else [])
+        self.days = [datetime.date.fromordinal(int(day)) for day in self.days]
+
+    def normalize_pages(self, normalize):
+        """Заменяет имена страниц шаблонами `normalize(name)`; страницы с
+        одинаковым шаблоном получают один номер"""
+        ids = {}  # {шаблон: номер, ...}
+        renumber = [ids.setdefault(name, len(ids))
+                    for name in map(normalize, self.pages)]
+        self.pages = list(ids)
+        if len(ids) != len(renumber):
+            self.page = array.array('I', map(renumber.__getitem__,
+                                             self.page))
+
+    def close(self):
+        for view in reversed(self._views):
+            view.release()
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def load(path, **options):
+    """Статистика `LogStat(**options)` по файлу столбцов `path`, равная
+    статистике по исходному логу"""
+    stat = LogStat(**options)
+    with Columns(path) as cols:
+        if stat.normalizer is not None:
+            cols.normalize_pages(stat.normalizer.normalize)
+        _load_pages(stat, cols)
+
+        for agent, count in Counter(cols.agent).items():
+            stat._browsers[cols.agents[agent]] = count
+        for ip, count in Counter(cols.ip).items():
+            stat._clients[cols.ips[ip]] = {'count': count}
+        for (day, ip), count in Counter(zip(cols.day, cols.ip)).items():
+            date = cols.days[day]
+            if date not in stat._days:
+                stat._days[date] = {}
+            stat._days[date][cols.ips[ip]] = count
+
+        if stat.distinct_clients:
+            _load_visitors(stat, cols)
+        if stat.rollup is not None:
+            _load_rollup(stat, cols)
+        if stat.windows is not None:
+            _load_windows(stat, cols)
+        if stat.sessions is not None:
+            _load_sessions(stat, cols)
+    stat._rebuild_leaders()
+    return stat
+
+
+def _load_pages(stat, cols):
+    counts = Counter(cols.page)
+    timed = {}  # {id страницы: [сумма, минимум, максимум, последняя], ...}
+    mask = bytes(cols.flags).translate(
+        bytes(i & has_req_time for i in range(256)))
+    numbered = enumerate(zip(compress(cols.page, mask),
+                             compress(cols.req_time, mask)), 1)
+    for index, (page, value) in numbered:
+        times = timed.get(page)
+        if times is None:
+            timed[page] = [value, value, value, index]
+            continue
+        times[0] += value
+        if value < times[1]:
+            times[1] = value
+        elif value > times[2]:
+            times[2] = value
+        times[3] = index
+    stat.timed = mask.count(has_req_time)
+
+    sketches = {}
+    if stat.percentiles:
+        for page in timed:
+            sketches[page] = QuantileSketch()
+        for page, value in zip(compress(cols.page, mask),
+                               compress(cols.req_time, mask)):
+            sketches[page].add(value)
+
+    for page, count in counts.items():
+        name = cols.pages[page]
+        item = stat._pages[name] = stat.page_class(
+            name, None, stat.num,
+            sketches.get(page, QuantileSketch()) if stat.percentiles
+            else None)
+        stat.num += 1
+        item.count = count
+        if page in timed:
+            total, item.fast_req_t, item.slow_req_t, item.last = timed[page]
+            item.req_times = total
+            item.avg = total / count
+
+
+def _load_visitors(stat, cols):
+    hashes = [HyperLogLog.hash(ip) for ip in cols.ips]
+    pages = [stat._pages[name] for name in cols.pages]
+    days = []
+    for date in cols.days:
+        days.append(stat._day_visitors.setdefault(
+            date, HyperLogLog(stat.day_hll_precision)))
+    for page in pages:
+        page.visitors = HyperLogLog(stat.page_hll_precision)
+    for page, ip, day in zip(cols.page, cols.ip, cols.day):
+        pages[page].visitors.add_hash(hashes[ip])
+        days[day].add_hash(hashes[ip])
+
+
+def _load_rollup(stat, cols):
+    errors = [code[:1] in ('4', '5') for code in cols.codes]
+    minutes = {}
+    for time, code, value, flags in zip(cols.time, cols.code, cols.req_time,
+                                        cols.flags):
+        if not flags & has_minute:
+            continue
+        minute = time // 60
+        if minute not in minutes:
+            minutes[minute] = [0, 0, 0, 0]
+        bucket = minutes[minute]
+        bucket[0] += 1
+        if flags & has_req_time:
+            bucket[1] += 1
+            bucket[2] += value
+        if errors[code]:
+            bucket[3] += 1
+
+    start = datetime.datetime(1970, 1, 1)
+    for minute, bucket in minutes.items():
+        stat.rollup.minutes[start + datetime.timedelta(minutes=minute)] = \
+            bucket
+
+
+def _load_windows(stat, cols):
+    for time, page, ip, value, flags in zip(cols.time, cols.page, cols.ip,
+                                            cols.req_time, cols.flags):
+        if flags & has_minute:
+            stat.windows.add_minute(
+                time // 60, cols.pages[page], cols.ips[ip],
+                str(value) if flags & has_req_time else '')
+
+
+def _load_sessions(stat, cols):
+    for time, ip, flags in zip(cols.time, cols.ip, cols.flags):
+        if flags & has_minute:
+            stat.sessions.add_second(time, cols.ips[ip])
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2:
+        convert(sys.argv[1], sys.argv[2])
+    else:
+        pprint.pprint(load(sys.argv[1]).results())
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+import os
+import bz2
+import gzip
+import lzma
+import mmap
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+block_magic = 0x314159265359
+eos_magic = 0x177245385090
+read_size = 1 << 20
+
+
+def find_magic(data, magic):
+    """Битовые смещения всех вхождений 48-битной сигнатуры `magic` в `data`"""
+    found = []
+    for shift in range(8):
+        window = (magic << (16 - shift)).to_bytes(8, 'big')
+        needle = window[1:6]
+        pos = data.find(needle, 1)
+        while pos != -1:
+            start = (pos - 1) * 8 + shift
+            value = int.from_bytes(data[pos - 1:pos + 6], 'big')
+            if (value >> (8 - shift)) & ((1 << 48) - 1) == magic:
+                found.append(start)
+            pos = data.find(needle, pos + 1)
+    return sorted(found)
+
+
+def bz2_regions(data):
+    """Делит bz2-архив (в том числе из нескольких потоков) на блоки:
+    список битовых диапазонов [начало блока, конец блока)"""
+    blocks = find_magic(data, block_magic)
+    bounds = sorted(blocks + find_magic(data, eos_magic))
+    blocks = set(blocks)
+    regions = []
+    for start, end in zip(bounds, bounds[1:]):
+        if start in blocks:
+            regions.append((start, end))
+    return regions
+
+
+def make_stream(data, start, end):
+    """Собирает из битов [start, end) отдельный bz2-поток из одного блока"""
+    first = start // 8
+    last = (end + 7) // 8
+    bits = end - start
+    value = int.from_bytes(data[first:last], 'big') >> (last * 8 - end)
+    value &= (1 << bits) - 1
+    crc = (value >> (bits - 80)) & 0xffffffff
+    value = (value << 80) | (eos_magic << 32) | crc
+    bits += 80
+    pad = -bits % 8
+    return b'BZh9' + (value << pad).to_bytes((bits + pad) // 8, 'big')
+
+
+def decompress_region(path, start, end):
+    with open(path, 'rb') as f:
+        f.seek(start // 8)
+        data = f.read((end + 7) // 8 - start // 8)
+    shift = start // 8 * 8
+    return bz2.decompress(make_stream(data, start - shift, end - shift))
+
+
+def bz2_parallel_blocks(path, processes=None):
+    """Генератор распакованных блоков bz2-архива по порядку. Блоки
+    распаковываются в `processes` процессах, одновременно в работе не больше
+    2 * `processes` блоков"""
+    processes = processes or os.cpu_count()
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            regions = deque(bz2_regions(data))
+
+    with ProcessPoolExecutor(processes) as pool:
+        pending = deque()
+        while regions or pending:
+            while regions and len(pending) < 2 * processes:
+                region = regions.popleft()
+                pending.append(
+                    (region, pool.submit(decompress_region, path, *region)))
+
+            (start, end), future = pending.popleft()
+            try:
+                yield future.result()
+                continue
+            except (OSError, ValueError):
+                pass
+
+            # Сигнатура блока случайно встретилась внутри сжатых данных:
+            # склеиваем регион со следующими, пока он не распакуется
+            while True:
+                if pending:
+                    (_, end), future = pending.popleft()
+                    future.cancel()
+                elif regions:
+                    _, end = regions.popleft()
+                else:
+                    raise OSError('Invalid bz2 data in ' + path)
+                try:
+                    block = decompress_region(path, start, end)
+                    break
+                except (OSError, ValueError):
+                    pass
+            yield block
+
+
+def threaded_blocks(opener, path, size=8):
+    """Генератор распакованных кусков файла: распаковка идёт в отдельном
+    потоке (zlib и lzma отпускают GIL), между потоками не больше `size`
+    кусков"""
+    blocks = queue.Queue(size)
+    stop = threading.Event()
+
+    def read():
+        try:
+            with opener(path, 'rb') as f:
+                block = f.read(read_size)
+                while block and not stop.is_set():
+                    blocks.put(block)
+                    block = f.read(read_size)
+            blocks.put(None)
+        except Exception as e:
+            blocks.put(e)
+
+    thread = threading.Thread(target=read, daemon=True)
+    thread.start()
+    try:
+        while True:
+            block = blocks.get()
+            if block is None:
+                break
+            if isinstance(block, Exception):
+                raise block
+            yield block
+    finally:
+        stop.set()
+        while thread.is_alive():
+            try:
+                blocks.get_nowait()
+            except queue.Empty:
+                thread.join(0.01)
+
+
+def plain_blocks(path):
+    with open(path, 'rb') as f:
+        block = f.read(read_size)
+        while block:
+            yield block
+            block = f.read(read_size)
+
+
+def decompressed_blocks(path, processes=None):
+    """Генератор распакованного содержимого файла кусками. Формат (bz2, gzip,
+    xz или несжатый) определяется по первым байтам"""
+    with open(path, 'rb') as f:
+        head = f.read(6)
+
+    if head.startswith(b'BZh'):
+        return bz2_parallel_blocks(path, processes)
+    if head.startswith(b'\x1f\x8b'):
+        return threaded_blocks(gzip.open, path)
+    if head.startswith(b'\xfd7zXZ\x00'):
+        return threaded_blocks(lzma.open, path)
+    return plain_blocks(path)
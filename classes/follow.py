@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+import os
+import sys
+import time
+import pickle
+import pprint
+
+from hw5_stripped import LogStat
+
+
+class LogFollower:
+    block_size = 1 << 20
+    head_size = 256
+
+    def __init__(self, path, checkpoint_path):
+        self.path = path
+        self.checkpoint_path = checkpoint_path
+        self.stat = LogStat()
+        self.offset = 0
+        self.inode = None  # (st_dev, st_ino)
+        self.head = b''
+        self._file = None
+
+        self._restore()
+
+    def _restore(self):
+        try:
+            with open(self.checkpoint_path, 'rb') as f:
+                state = pickle.load(f)
+        except FileNotFoundError:
+            return
+
+        self.stat = state['stat']
+        if isinstance(self.stat, bytes):
+            self.stat = LogStat.load(self.stat)
+        self.offset = state['offset']
+        self.inode = state['inode']
+        self.head = state['head']
+
+    def checkpoint(self):
+        tmp = self.checkpoint_path + '.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump({
+                'stat': self.stat.dump(),
+                'offset': self.offset,
+                'inode': self.inode,
+                'head': self.head
+            }, f, pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.checkpoint_path)
+
+    def _open(self):
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return False
+
+        st = os.fstat(f.fileno())
+        self._file = f
+        head = self._read_head()
+        if (st.st_dev, st.st_ino) != self.inode or st.st_size < self.offset \
+                or head[:len(self.head)] != self.head:
+            self.offset = 0
+
+        self.inode = (st.st_dev, st.st_ino)
+        self.head = head
+        return True
+
+    def _read_head(self):
+        self._file.seek(0)
+        return self._file.read(self.head_size)
+
+    def _is_replaced(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        return (st.st_dev, st.st_ino) != self.inode
+
+    def _read(self):
+        # файл обрезали: он короче прочитанного или начинается иначе (после
+        # copytruncate до следующего опроса могли дописать больше)
+        head = self._read_head()
+        if os.fstat(self._file.fileno()).st_size < self.offset or \
+                head[:len(self.head)] != self.head:
+            self.offset = 0
+        self.head = head
+
+        self._file.seek(self.offset)
+        read = 0
+        data = b''
+        while True:
+            block = self._file.read(self.block_size)
+            if not block:
+                break
+            data += block
+            end = data.rfind(b'\n') + 1
+            if end:
+                self.stat.add_from_buffer(data, 0, end)
+                self.offset += end
+                read += end
+                data = data[end:]
+        return read
+
+    def poll(self):
+        """Разбирает дописанные в лог полные строки и возвращает их размер в
+        байтах. Незаконченная последняя строка остаётся до следующего
+        вызова. Если файл подменили (ротация), дочитывает старый файл и
+        переходит на новый"""
+        if self._file is None and not self._open():
+            return 0
+
+        read = self._read()
+        while self._is_replaced():
+            read += self._read()
+            self._file.close()
+            self._file = None
+            if not self._open():
+                break
+            read += self._read()
+        return read
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def run(self, interval=1.0, checkpoint_every=60.0):
+        last_checkpoint = time.monotonic()
+        try:
+            while True:
+                self.poll()
+                if time.monotonic() - last_checkpoint >= checkpoint_every:
+                    self.checkpoint()
+                    last_checkpoint = time.monotonic()
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.checkpoint()
+            self.close()
+
+
+if __name__ == '__main__':
+    follower = LogFollower(sys.argv[1], sys.argv[2])
+    follower.run()
+    if follower.stat.fastest is not None:
+        pprint.pprint(follower.stat.results())
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+import re
+
+# формат, который разбирает pattern из hw5_stripped (со временем обработки)
+default_format = '$remote_addr - - [$time_local] "$request" $status ' \
+                 '$body_bytes_sent "$http_referer" "$http_user_agent" ' \
+                 '$req_time'
+combined_format = '$remote_addr - $remote_user [$time_local] "$request" ' \
+                  '$status $body_bytes_sent "$http_referer" ' \
+                  '"$http_user_agent"'
+apache_combined_format = '%h %l %u %t "%r" %>s %b "%{Referer}i" ' \
+                         '"%{User-agent}i"'
+
+re_variable = re.compile(
+    r'\$(?P<nginx>[A-Za-z_]\w*)|%(?:\{(?P<header>[^}]*)\})?[<>]?'
+    r'(?P<apache>[a-zA-Z%])')
+apache_variables = {
+    'h': 'remote_addr', 'a': 'remote_addr', 'l': 'remote_logname',
+    'u': 'remote_user', 'r': 'request', 's': 'status',
+    'b': 'body_bytes_sent', 'B': 'body_bytes_sent', 'U': 'uri',
+    'D': 'request_time_us', 'T': 'request_time_s'
+}
+methods = 'GET|PUT|POST|HEAD|OPTIONS|DELETE'
+# {переменная: (регулярное выражение, (поля LogStat в его группах)), ...},
+# остальные переменные пропускаются
+fragments = {
+    'remote_addr': (r'(\S*)', ('ip',)),
+    'time_local': (r'([\d\w/]*):(\S*) \S*', ('time', 'clock')),
+    'request': (r'(?:' + methods + r') ([^*]\S*) \S*', ('name',)),
+    'request_uri': (r'([^*\s]\S*)', ('name',)),
+    'uri': (r'([^*\s]\S*)', ('name',)),
+    'status': (r'(\d{3})', ('code',)),
+    'http_user_agent': (r'(.*?)', ('agent',)),
+    'req_time': (r'(\d+)', ('req_time',)),
+    'request_time_us': (r'(\d*|-)', ('req_time',)),
+    'request_time': (r'(\d*\.?\d*|-)', ('req_time',)),
+    'request_time_s': (r'(\d*|-)', ('req_time',))
+}
+# время обработки в LogStat - целые микросекунды или ''
+conversions = {
+    'request_time_us': ["if req_time == '-':",
+                        "    req_time = ''"],
+    'request_time': ["req_time = seconds_to_us(req_time)",
+                     "if req_time is None:",
+                     "    return None"]
+}
+conversions['request_time_s'] = conversions['request_time']
+
+_compiled = {}  # {формат: функция разбора, ...}
+
+
+def seconds_to_us(value):
+    """Время в секундах (nginx $request_time) в строку с микросекундами или
+    None, если это не число"""
+    if value in ('', '-'):
+        return ''
+    try:
+        return str(round(float(value) * 1000000))
+    except ValueError:
+        return None
+
+
+def split_format(spec):
+    """[литерал, переменная, литерал, ..., переменная, литерал]"""
+    tokens = ['']
+    pos = 0
+    for variable in re_variable.finditer(spec):
+        tokens[-1] += spec[pos:variable.start()]
+        pos = variable.end()
+        if variable.group('nginx'):
+            tokens += [variable.group('nginx'), '']
+        elif variable.group('apache') == '%':
+            tokens[-1] += '%'
+        elif variable.group('apache') == 't':
+            tokens[-1] += '['
+            tokens += ['time_local', ']']
+        elif variable.group('apache') in 'io' and variable.group('header'):
+            tokens += ['http_' + variable.group('header').lower()
+                       .replace('-', '_'), '']
+        elif variable.group('apache') in apache_variables:
+            tokens += [apache_variables[variable.group('apache')], '']
+        else:
+            raise ValueError('Unknown directive ' + variable.group(0))
+    tokens[-1] += spec[pos:]
+    return tokens
+
+
+def format_fields(spec):
+    """Поля LogStat, которые есть в строках формата `spec`"""
+    return {field for variable in split_format(spec)[1::2]
+            if variable in fragments for field in fragments[variable][1]}
+
+
+def untimed_format(spec):
+    """`spec` без времени обработки в конце строки после пробела или None,
+    если формат так не заканчивается"""
+    tokens = split_format(spec)
+    if len(tokens) < 3 or tokens[-1] or not tokens[-3].endswith(' ') or \
+            fragments.get(tokens[-2], ('', ()))[1] != ('req_time',):
+        return None
+    last = list(re_variable.finditer(spec))[-1]
+    return spec[:last.start() - 1]
+
+
+def format_source(spec):
+    """Исходный код функции разбора строки в формате `spec` и словарь
+    регулярных выражений, которые она использует.
+
+    Начало строки до первого поля в кавычках со свободным текстом (в
+    combined это referrer) разбирается одним регулярным выражением `head`,
+    поля после него ищутся с конца строки по литералам, а само поле
+    забирает всё, что осталось между ними"""
+    tokens = split_format(spec)
+    literals = tokens[::2]
+    variables = tokens[1::2]
+    found = format_fields(spec)
+    missing = {'ip', 'time', 'name', 'code'} - found
+    if missing:
+        raise ValueError('Log format has no {0}: {1}'.format(
+            ', '.join(sorted(missing)), spec))
+    if '' in literals[1:-1]:
+        raise ValueError('Variables without a separator: ' + spec)
+
+    greedy = len(variables)
+    for i, variable in enumerate(variables):
+        if literals[i].endswith('"') and literals[i + 1].startswith('"') \
+                and (variable not in fragments or
+                     variable == 'http_user_agent'):
+            greedy = i
+            break
+
+    head = re.escape(literals[0])
+    groups = []
+    for i in range(greedy):
+        fragment, fields = fragments.get(variables[i], (r'.*?', ()))
+        head += fragment + re.escape(literals[i + 1])
+        groups += fields
+    if greedy == len(variables):
+        head += r'\Z'
+    patterns = {'head': head}
+
+    code = ['def parse(line):',
+            '    match = head(line)',
+            '    if match is None:',
+            '        return None']
+    if groups:
+        code.append('    {0} = match.{1}'.format(
+            ', '.join(groups),
+            'group(1)' if len(groups) == 1 else 'groups()'))
+    for field in ('agent', 'req_time'):
+        if field not in found:
+            code.append("    {0} = ''".format(field))
+
+    if greedy < len(variables):
+        code += ['    pos = match.end()', '    end = len(line)']
+        if literals[-1]:
+            code += ['    end -= {0}'.format(len(literals[-1])),
+                     '    if end < pos or not line.endswith({0!r}):'.format(
+                         literals[-1]),
+                     '        return None']
+        for i in range(len(variables) - 1, greedy, -1):
+            code += ['    start = line.rfind({0!r}, pos, end)'.format(
+                         literals[i]),
+                     '    if start == -1:',
+                     '        return None']
+            if variables[i] in fragments:
+                fragment, fields = fragments[variables[i]]
+                patterns['tail{0}'.format(i)] = fragment + r'\Z'
+                code += ['    match = tail{0}(line, start + {1}, end)'.format(
+                             i, len(literals[i])),
+                         '    if match is None:',
+                         '        return None',
+                         '    {0} = match.{1}'.format(
+                             ', '.join(fields), 'group(1)' if len(fields) == 1
+                             else 'groups()')]
+            code.append('    end = start')
+        if variables[greedy] in fragments:
+            code.append('    agent = line[pos:end]')
+
+    for variable in variables:
+        code += ['    ' + line for line in conversions.get(variable, [])]
+    code.append('    return (ip, time, clock, name, code, agent, req_time)')
+    return '\n'.join(code) + '\n', patterns
+
+
+def compile_format(spec):
+    """Функция разбора строки в формате `spec` (переменные nginx `$name` и
+    директивы Apache `%x`), возвращающая поля `field_names` или None.
+    Время обработки в конце строки после пробела, как в `pattern`,
+    необязательно: строку без него разбирает `untimed_format(spec)`.
+    Функции кэшируются по строке формата, исходный код - в `source`"""
+    if spec not in _compiled:
+        source, patterns = format_source(spec)
+        namespace = {name: re.compile(pattern, re.DOTALL).match
+                     for name, pattern in patterns.items()}
+        namespace['seconds_to_us'] = seconds_to_us
+        exec(compile(source, '<log_format>', 'exec'), namespace)
+        parse = namespace['parse']
+        parse.source = source
+        untimed = untimed_format(spec)
+        if untimed is not None:
+            parse = either(parse, compile_format(untimed))
+        _compiled[spec] = parse
+    return _compiled[spec]
+
+
+def either(timed, untimed):
+    """Разбор строки функцией `timed`, а если она не подходит - `untimed`"""
+    def parse(line):
+        return timed(line) or untimed(line)
+    parse.source = timed.source + untimed.source
+    return parse
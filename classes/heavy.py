@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+import sys
+import heapq
+import pprint
+
+from hw5_stripped import parse_line
+
+
+class SpaceSaving:
+    """Приближённый подсчёт самых частых ключей (алгоритм Space-Saving) в
+    памяти на `capacity` счётчиков. Для ключа из `counters` истинное
+    количество лежит в [count - error, count]"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.total = 0
+        self.counters = {}  # {key: [count, error], ...}
+        self._heap = []  # [(count, key), ...], count может отставать
+
+    def add(self, key):
+        self.total += 1
+        if key in self.counters:
+            self.counters[key][0] += 1
+            return
+
+        if len(self.counters) < self.capacity:
+            self.counters[key] = [1, 0]
+            heapq.heappush(self._heap, (1, key))
+            return
+
+        while True:
+            count, old = self._heap[0]
+            if self.counters[old][0] == count:
+                break
+            heapq.heapreplace(self._heap, (self.counters[old][0], old))
+
+        del self.counters[old]
+        self.counters[key] = [count + 1, count]
+        heapq.heapreplace(self._heap, (count + 1, key))
+
+    def top(self):
+        """Ключ с наибольшим счётчиком (если несколько, лексикографически
+        наименьший) и его (count, error)"""
+        key = min(self.counters,
+                  key=lambda k: (-self.counters[k][0], k))
+        return key, tuple(self.counters[key])
+
+    def max_error(self):
+        """Верхняя граница ошибки любого счётчика"""
+        return self.total // self.capacity
+
+
+class HeavyHitterStat:
+    def __init__(self, capacity=1000):
+        self.pages = SpaceSaving(capacity)
+        self.clients = SpaceSaving(capacity)
+        self.browsers = SpaceSaving(capacity)
+
+    def add_from_stdin(self):
+        for line in sys.stdin:
+            self.add_line(line)
+
+    def add_line(self, line):
+        fields = parse_line(line[:-1])
+        if fields:
+            ip, _, _, name, _, agent, _ = fields
+            self.pages.add(name)
+            self.clients.add(ip)
+            self.browsers.add(agent)
+
+    def results(self):
+        if not self.pages.total:
+            self.add_from_stdin()
+
+        results = {}
+        errors = {}
+        for key, counter in (('MostPopularPage', self.pages),
+                             ('MostActiveClient', self.clients),
+                             ('MostPopularBrowser', self.browsers)):
+            results[key], (_, errors[key]) = counter.top()
+        results['Errors'] = errors
+        return results
+
+
+if __name__ == '__main__':
+    pprint.pprint(HeavyHitterStat(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 1000).results())
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+import math
+import hashlib
+
+
+class HyperLogLog:
+    """Оценка числа различных значений в памяти на 2 ** `precision` байт.
+    Стандартная ошибка около 1.04 / sqrt(2 ** precision). Счётчики с
+    одинаковой точностью можно объединять"""
+    __slots__ = ('precision', 'registers')
+
+    def __init__(self, precision=10):
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    @staticmethod
+    def hash(value):
+        return int.from_bytes(hashlib.blake2b(
+            value.encode('utf-8', 'surrogateescape'), digest_size=8
+        ).digest(), 'big')
+
+    def add(self, value):
+        self.add_hash(self.hash(value))
+
+    def add_hash(self, value_hash):
+        bits = 64 - self.precision
+        index = value_hash >> bits
+        rank = bits - (value_hash & ((1 << bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def count(self):
+        m = len(self.registers)
+        if m >= 128:
+            alpha = 0.7213 / (1 + 1.079 / m)
+        else:
+            alpha = {16: 0.673, 32: 0.697, 64: 0.709}[m]
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return round(estimate)
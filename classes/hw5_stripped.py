@@ -1,26 +1,49 @@
 #!/usr/bin/env python3
 import sys
+import os
+import mmap
 import datetime
 import re
 import time
 import unittest
 import bz2
 import urllib.request
+import itertools
+import json
+import zlib
+import array
+import pickle
+import struct
 
-epsilon = sys.float_info.epsilon
+from quantiles import QuantileSketch
+from hll import HyperLogLog
+from rollup import Rollup
+from compressed import decompressed_blocks
+from instrument import Instrument, count_lines
+from leaderboard import Leaderboard, SlowestAverage
+from windows import SlidingWindows
+from sessions import Sessionizer
+from formats import compile_format, format_fields
+from spill import Spill
+from normalize import Normalizer
+
+state_magic = b'LOGSTAT1'
+state_version = 1
+section_size = struct.Struct('<Q')
+perf_counter = time.perf_counter
 months = [
     'Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
     'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'
 ]
 
 re_ip = r'^\S*'
-re_time = r'(?P<time>[\d\w/]*):\S* \S*'
+re_time = r'(?P<time>[\d\w/]*):(?P<clock>\S*) \S*'
 re_request = r'"(GET|PUT|POST|HEAD|OPTIONS|DELETE) (?P<name>[^\*]\S*) \S*"'
-re_code = r'\d{3}'
+re_code = r'(?P<code>\d{3})'
 re_weight = r'\d*'
 re_referrer = r'".*"'
 re_user_agent = r'.*'
-re_request_time = r'( \d*)?$'
+re_request_time = r'( \d+)?$'
 pattern = re.compile(' '.join([
     r'(?P<ip>' + re_ip + r')',
     r'- -',
@@ -31,24 +54,78 @@ pattern = re.compile(' '.join([
     re_referrer,
     r'"(?P<agent>' + re_user_agent + r')"']
 ) + r'(?P<req_time>' + re_request_time + r')')
+bytes_pattern = re.compile(pattern.pattern.encode(), re.MULTILINE)
+field_names = ('ip', 'time', 'clock', 'name', 'code', 'agent', 'req_time')
+
+
+def parse_line(line):
+    """Поля `field_names` строки лога или None"""
+    log = pattern.match(line)
+    if log:
+        return log.group(*field_names)
+    return None
+
+
+def line_spans(buf, start=0, end=None):
+    """(начало, конец) строк буфера байт `buf` в диапазоне [start, end) без
+    '\\n' и '\\r\\n'. У последней строки без '\\n' отбрасывается последний
+    байт, как `add_line` отбрасывает line[:-1]"""
+    find = buf.find
+    pos = start
+    end = len(buf) if end is None else end
+    while pos < end:
+        eol = find(b'\n', pos, end)
+        if eol == -1:
+            yield pos, end - 1
+            return
+        nxt = eol + 1
+        if eol > pos and buf[eol - 1] == 13:  # \r\n
+            eol -= 1
+        yield pos, eol
+        pos = nxt
+
+
+def req_time_value(req_time):
+    """Время обработки из поля req_time в микросекундах или -1, если его
+    нет; `Page` считает так же"""
+    return int(req_time) if req_time else -1
 
 
 class Page:
-    def __init__(self, name, req_time, num):
+    __slots__ = ('name', 'count', 'fast_req_t', 'slow_req_t', 'req_times',
+                 'avg', 'num', 'last', 'sketch', 'visitors')
+
+    def __init__(self, name, req_time, num, sketch=None):
         self.name = name
         self.count = 1
+        self.fast_req_t = None
+        self.slow_req_t = None
+        self.req_times = 0
+        self.avg = 0
         if req_time:
             r_t = int(req_time)
             self.fast_req_t = r_t
             self.slow_req_t = r_t
             self.req_times = r_t
             self.avg = r_t
+            if sketch is not None:
+                sketch.add(r_t)
         self.num = num
+        self.last = -1  # номер последней строки со временем обработки
+        self.sketch = sketch  # QuantileSketch времён обработки или None
+        self.visitors = None  # HyperLogLog клиентов или None
 
     def upd_page(self, req_time):
         if req_time:
-            self.upd_times(int(req_time))
-            self.req_times += int(req_time)
+            r_t = int(req_time)
+            if self.fast_req_t is None:
+                self.fast_req_t = r_t
+                self.slow_req_t = r_t
+            else:
+                self.upd_times(r_t)
+            self.req_times += r_t
+            if self.sketch is not None:
+                self.sketch.add(r_t)
         self.count += 1
         self.avg = self.req_times / self.count
 
@@ -58,9 +135,51 @@ class Page:
         elif req_t > self.slow_req_t:
             self.slow_req_t = req_t
 
+    def merge(self, other):
+        self.count += other.count
+        self.req_times += other.req_times
+        self.avg = self.req_times / self.count
+        if self.visitors is not None:
+            self.visitors.merge(other.visitors)
+        if other.fast_req_t is None:
+            return
+
+        if self.sketch is not None:
+            self.sketch.merge(other.sketch)
+
+        if self.fast_req_t is None:
+            self.fast_req_t = other.fast_req_t
+            self.slow_req_t = other.slow_req_t
+        else:
+            self.upd_times(other.fast_req_t)
+            self.upd_times(other.slow_req_t)
+
 
 class LogStat:
-    def __init__(self):
+    day_hll_precision = 12
+    page_hll_precision = 8
+    spill_partitions = 16
+    spill_check_every = 1024  # строк между подсчётами ключей в памяти
+    page_class = Page
+    intern = staticmethod(sys.intern)  # для имён клиентов
+    # {ключ results(): агрегаты, по которым он считается, ...}
+    result_needs = {
+        'FastestPage': 'pages',
+        'SlowestPage': 'pages',
+        'SlowestAveragePage': 'pages',
+        'MostPopularPage': 'pages',
+        'TopPages': 'pages',
+        'MostActiveClient': 'clients',
+        'TopClients': 'clients',
+        'MostActiveClientByDay': 'days',
+        'MostPopularBrowser': 'browsers',
+        'TopBrowsers': 'browsers'
+    }
+
+    def __init__(self, percentiles=False, distinct_clients=False,
+                 rollups=False, instrument=False, top=1, windows=(),
+                 log_format=None, spill=None, normalize=None,
+                 sessions=None, only=None):
         self.fastest = None  # Page
         self.slowest = None  # Page
         self.slowest_avg = None  # Page
@@ -68,13 +187,307 @@ class LogStat:
         self.most_active_client = None  # ip
         self.macs = {}  # {date: client, ...}
         self.popular_browser = None
+        self.slowest_p99 = None  # (Page, p99)
 
+        self.percentiles = percentiles
+        self.distinct_clients = distinct_clients
+        self.rollup = Rollup() if rollups else None
+        # окна за последние `windows` минут или None
+        self.windows = SlidingWindows(windows) if windows else None
+        # сессии клиентов с паузой не больше `sessions` секунд или None
+        self.sessions = Sessionizer(sessions) if sessions else None
+        # формат строк (см. formats.compile_format) или None - `pattern`
+        self.log_format = log_format
+        # в строках есть время обработки; без него страниц по времени нет
+        self._timed = log_format is None or \
+            'req_time' in format_fields(log_format)
+        # шаблоны имён страниц (Normalizer, True - по умолчанию) или None
+        self.normalizer = Normalizer() if normalize is True else \
+            normalize or None
+        self.parse_line = self._parser()
+        # ключи results() из `result_needs`, которые нужны, или None - все;
+        # агрегаты для остальных ключей не ведутся
+        self.only = None if only is None else frozenset(only)
+        needs = set(self.result_needs.values())
+        if self.only is not None:
+            unknown = self.only - set(self.result_needs)
+            if unknown:
+                raise ValueError('Unknown results: ' +
+                                 ', '.join(sorted(unknown)))
+            if instrument:
+                raise ValueError('only does not support instrument')
+            if top < 2 and any(key.startswith('Top') for key in self.only):
+                raise ValueError('Top results need top > 1')
+            needs = {self.result_needs[key] for key in self.only}
+            if percentiles or distinct_clients:
+                needs.add('pages')
+        self._need_pages = 'pages' in needs
+        self._need_clients = 'clients' in needs
+        self._need_days = 'days' in needs
+        self._need_browsers = 'browsers' in needs
+        self.instrument = None  # Instrument или None
+        if instrument:
+            self.instrument = Instrument(
+                1000 if instrument is True else instrument)
+            # без инструментирования add_line не делает лишних проверок
+            self.add_line = self._add_line_instrumented
+        # при более чем `spill` ключах страниц, клиентов и дней в памяти
+        # агрегаты сбрасываются на диск и сводятся в results()
+        self.spill = None  # Spill или None
+        if spill:
+            self.spill = Spill(spill, self.spill_partitions)
+            self._spill_countdown = self.spill_check_every
+        self._install_pipeline()
         self.num = 0
+        self.timed = 0  # количество строк со временем обработки
+        self.top = top
+
+        self._top_pages = Leaderboard(top)
+        self._top_clients = Leaderboard(top)
+        self._top_browsers = Leaderboard(top)
+        self._slowest_avg = SlowestAverage()
 
         self._pages = {}
         self._browsers = {}
         self._clients = {}
         self._days = {}  # {date: {name: count, ...}, ...}
+        # {date: {name: номер добавления в день, ...}, ...}, строится при
+        # первой ничьей за лидерство в день, сбрасывается при смене _days
+        self._day_seqs = {}
+        self._day_visitors = {}  # {date: HyperLogLog, ...}
+
+        self._last_time = None
+        self._last_date = None
+
+    def _parser(self):
+        parse = parse_line if self.log_format is None else \
+            compile_format(self.log_format)
+        if self.normalizer is not None:
+            parse = self.normalizer.parser(parse)
+        return parse
+
+    def _pipeline(self):
+        """Функция add(ip, date, clock, name, code, agent, req_time), которая
+        ведёт только нужные агрегаты (`_need_*`) и дополнительную
+        статистику, и её этапы {'page', 'client', 'extra'} для замеров"""
+        def skip(*fields):
+            return None
+
+        if self._need_pages and self._need_browsers:
+            add_page = self._add_page
+        elif self._need_pages:
+            def add_page(name, req_time, agent):
+                return self._add_page(name, req_time, None)
+        elif self._need_browsers:
+            def add_page(name, req_time, agent):
+                self._add_browser(agent)
+        else:
+            add_page = skip
+
+        if self._need_clients and self._need_days:
+            add_client = self._add_client
+        elif self._need_clients:
+            def add_client(ip, date):
+                self._add_client(ip, None)
+        elif self._need_days:
+            add_client = self._add_to_days
+        else:
+            add_client = skip
+
+        visitors = self.distinct_clients
+        rollup = self.rollup
+        windows = self.windows
+        sessions = self.sessions
+
+        def extra(page, ip, date, clock, name, code, req_time):
+            if visitors:
+                self._add_visitor(page, ip, date)
+            if rollup is not None:
+                rollup.add(date, clock, code, req_time)
+            if windows is not None:
+                windows.add(date, clock, name, ip, req_time)
+            if sessions is not None:
+                sessions.add(date, clock, ip)
+
+        if not visitors and rollup is None and windows is None and \
+                sessions is None:
+            def add(ip, date, clock, name, code, agent, req_time):
+                add_page(name, req_time, agent)
+                add_client(ip, date)
+            extra = skip
+        else:
+            def add(ip, date, clock, name, code, agent, req_time):
+                page = add_page(name, req_time, agent)
+                add_client(ip, date)
+                extra(page, ip, date, clock, name, code, req_time)
+        return add, {'page': add_page, 'client': add_client, 'extra': extra}
+
+    def _install_pipeline(self):
+        """`_add` и `_stages` из `_pipeline`; вызывается при создании и
+        после замены дополнительной статистики"""
+        add, self._stages = self._pipeline()
+        if self.spill is not None:
+            self._add_unspilled = add
+            add = self._add_spilling
+        self._add = add
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # функции из exec и замыкания не сериализуются
+        for name in ('parse_line', '_add', '_add_unspilled', '_stages'):
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.parse_line = self._parser()
+        self._install_pipeline()
+
+    def dump(self):
+        """Состояние статистики в компактном двоичном виде для `load`:
+        таблицы страниц, браузеров, клиентов и дней - столбцами int64 и
+        строками имён, дополнительная статистика (rollup, окна, сессии,
+        скетчи и HyperLogLog) - через pickle, всё вместе сжато zlib"""
+        if self.spill is not None and self.spill.spills:
+            raise ValueError('Cannot dump a spilled LogStat')
+        pages = list(self._pages.values())
+        page_values = array.array('q')
+        for page in pages:
+            page_values.extend((
+                page.count, page.req_times, page.num, page.last,
+                -1 if page.fast_req_t is None else page.fast_req_t,
+                -1 if page.slow_req_t is None else page.slow_req_t))
+        # клиенты дней без счётчика (с `only` без клиентов) - в конце таблицы
+        client_ids = dict(zip(self._clients, itertools.count()))
+        for day in self._days.values():
+            for name in day:
+                client_ids.setdefault(name, len(client_ids))
+        day_values = array.array('q')
+        day_clients = array.array('q')
+        for date, day in self._days.items():
+            day_values.extend((date.toordinal(), len(day)))
+            for name, count in day.items():
+                day_clients.extend((client_ids[name], count))
+
+        extras = {name: getattr(self, name) for name in (
+            'rollup', 'windows', 'sessions', 'instrument', 'normalizer')
+            if getattr(self, name) is not None}
+        if self.percentiles:
+            extras['sketches'] = [page.sketch for page in pages]
+        if self.distinct_clients:
+            extras['visitors'] = [page.visitors for page in pages]
+            extras['day_visitors'] = self._day_visitors
+        header = {
+            'version': state_version,
+            'percentiles': self.percentiles,
+            'distinct_clients': self.distinct_clients,
+            'top': self.top,
+            'log_format': self.log_format,
+            'only': None if self.only is None else sorted(self.only),
+            'num': self.num,
+            'timed': self.timed,
+            'pages': len(pages),
+            'browsers': len(self._browsers),
+            'clients': len(client_ids)
+        }
+        columns = [
+            page_values,
+            array.array('q', self._browsers.values()),
+            array.array('q', (client['count']
+                              for client in self._clients.values())),
+            day_values,
+            day_clients
+        ]
+        if sys.byteorder == 'big':
+            for column in columns:
+                column.byteswap()
+        sections = [json.dumps(header).encode()]
+        for names in ((page.name for page in pages), self._browsers,
+                      client_ids):
+            sections.append('\n'.join(names).encode('utf-8',
+                                                     'surrogateescape'))
+        sections += [column.tobytes() for column in columns]
+        sections.append(pickle.dumps(extras, pickle.HIGHEST_PROTOCOL))
+        return state_magic + zlib.compress(b''.join(
+            section_size.pack(len(section)) + section
+            for section in sections))
+
+    @classmethod
+    def load(cls, data):
+        """Статистика из результата `dump`. Дополнительная статистика
+        читается через pickle, поэтому загружать можно только данные из
+        надёжного источника"""
+        if data[:len(state_magic)] != state_magic:
+            raise ValueError('Not a LogStat dump')
+        body = zlib.decompress(data[len(state_magic):])
+        sections = []
+        pos = 0
+        while pos < len(body):
+            size, = section_size.unpack_from(body, pos)
+            pos += section_size.size
+            sections.append(body[pos:pos + size])
+            pos += size
+        header = json.loads(sections[0])
+        if header['version'] != state_version:
+            raise ValueError('Unsupported LogStat dump version {0}'.format(
+                header['version']))
+        names = [section.decode('utf-8', 'surrogateescape').split('\n')
+                 if count else [] for section, count in zip(
+                     sections[1:4], (header['pages'], header['browsers'],
+                                     header['clients']))]
+        columns = []
+        for section in sections[4:9]:
+            column = array.array('q', section)
+            if sys.byteorder == 'big':
+                column.byteswap()
+            columns.append(column)
+        extras = pickle.loads(sections[9])
+
+        stat = cls(percentiles=header['percentiles'],
+                   distinct_clients=header['distinct_clients'],
+                   top=header['top'], log_format=header['log_format'],
+                   only=header['only'])
+        stat.num = header['num']
+        stat.timed = header['timed']
+        sketches = extras.pop('sketches', None)
+        visitors = extras.pop('visitors', None)
+        page_names, browsers, clients = names
+        page_values, browser_counts, client_counts, day_values, \
+            day_clients = columns
+        for i, name in enumerate(page_names):
+            count, req_times, num, last, fast, slow = page_values[6 * i:
+                                                                 6 * i + 6]
+            page = stat._pages[name] = stat.page_class(
+                name, None, num, sketches[i] if sketches else None)
+            page.count = count
+            page.req_times = req_times
+            page.avg = req_times / count
+            page.last = last
+            if fast != -1:
+                page.fast_req_t = fast
+                page.slow_req_t = slow
+            if visitors:
+                page.visitors = visitors[i]
+        stat._browsers = dict(zip(browsers, browser_counts))
+        stat._clients = {name: {'count': count}
+                         for name, count in zip(clients, client_counts)}
+        pos = 0
+        for ordinal, size in zip(day_values[::2], day_values[1::2]):
+            stat._days[datetime.date.fromordinal(ordinal)] = {
+                clients[client]: count for client, count in zip(
+                    day_clients[pos:pos + 2 * size:2],
+                    day_clients[pos + 1:pos + 2 * size:2])}
+            pos += 2 * size
+
+        stat._day_visitors = extras.pop('day_visitors', {})
+        for name, value in extras.items():
+            setattr(stat, name, value)
+        if stat.instrument is not None:
+            stat.add_line = stat._add_line_instrumented
+        stat.parse_line = stat._parser()
+        stat._install_pipeline()
+        stat._rebuild_leaders()
+        return stat
 
     def _upd_the_fastest_page(self, page):
         if self.fastest:
@@ -90,111 +503,556 @@ class LogStat:
 
         self.slowest = page
 
-    def _upd_the_slowest_avg_page(self, page):
-        if self.slowest_avg is None:
-            self.slowest_avg = page
+    def _upd_the_slowest_p99_page(self, page, p99):
+        if self.slowest_p99 is None or p99 > self.slowest_p99[1]:
+            self.slowest_p99 = (page, p99)
+
+    def _find_the_fastest_and_slowest_pages(self):
+        self.fastest = None
+        self.slowest = None
+        for page in self._pages.values():
+            if page.last == -1:
+                continue
+
+            if self.fastest is None or \
+                    page.fast_req_t < self.fastest.fast_req_t or \
+                    page.fast_req_t == self.fastest.fast_req_t and \
+                    page.last > self.fastest.last:
+                self.fastest = page
+
+            if self.slowest is None or \
+                    page.slow_req_t > self.slowest.slow_req_t or \
+                    page.slow_req_t == self.slowest.slow_req_t and \
+                    page.last > self.slowest.last:
+                self.slowest = page
+
+    def _get_the_most_active_clients_by_days(self):
+        for day in self._days.items():
+            self.macs[day[0]] = max(day[1], key=lambda n: day[1][n])
+
+    def _rebuild_leaders(self):
+        """Пересчитывает лидеров после изменения словарей не через _add"""
+        self._top_pages.rebuild(
+            {name: page.count for name, page in self._pages.items()})
+        self._top_clients.rebuild(
+            {name: client['count'] for name, client in self._clients.items()})
+        self._top_browsers.rebuild(self._browsers)
+        self._slowest_avg.rebuild(self._pages)
+        self._day_seqs = {}
+        self._get_the_most_active_clients_by_days()
+        self._find_the_fastest_and_slowest_pages()
+
+    def merge(self, other):
+        """Добавляет к статистике статистику `other`, посчитанную по строкам,
+        идущим в логе после уже учтённых. `other` после этого использовать
+        нельзя: его страницы переходят в `self`. Счётчики при склейке только
+        растут, поэтому лидеры обновляются только по ключам `other`"""
+        if other.spill is not None and other.spill.spills:
+            raise ValueError('Cannot merge a spilled LogStat')
+        for name, other_page in other._pages.items():
+            if other_page.last != -1:
+                other_page.last += self.timed
+
+            if name in self._pages:
+                page = self._pages[name]
+                page.merge(other_page)
+                if other_page.last != -1:
+                    page.last = other_page.last
+            else:
+                page = self._pages[name] = other_page
+                page.num = self.num
+                self.num += 1
+            self._upd_merged_page(page)
+
+        self.timed += other.timed
+        self._merge_browsers(other._browsers.items())
+        self._merge_clients((name, client['count'])
+                            for name, client in other._clients.items())
+        for date, clients in other._days.items():
+            self._merge_day(date, clients.items())
+
+        for date, visitors in other._day_visitors.items():
+            if date in self._day_visitors:
+                self._day_visitors[date].merge(visitors)
+            else:
+                self._day_visitors[date] = visitors
+
+        if self.rollup is not None:
+            self.rollup.merge(other.rollup)
+        if self.windows is not None:
+            self.windows.merge(other.windows)
+        if self.sessions is not None:
+            self.sessions.merge(other.sessions)
+        if self.instrument is not None and other.instrument is not None:
+            self.instrument.merge(other.instrument)
+
+        if self.spill is not None:
+            self._spill_if_needed()
+
+    def _upd_merged_page(self, page):
+        """Лидеры после склейки страницы: её счётчик и времена обработки
+        изменились, а последняя строка стала самой поздней"""
+        if page.count >= self._top_pages.threshold:
+            self._top_pages.update(page.name, page.count)
+        if page.last == -1:
             return
 
-        if page.avg > self.slowest_avg.avg:
-            self.slowest_avg = page
-        elif abs(page.avg - self.slowest_avg.avg) < \
-                max(abs(page.avg), abs(self.slowest_avg.avg)) * epsilon:
-            if page.num < self.slowest_avg.num:
-                self.slowest_avg = page
+        self._slowest_avg.dirty.add(page)
+        # у остальных страниц времена и последние строки прежние
+        fastest = self.fastest
+        if fastest is None or page.fast_req_t < fastest.fast_req_t or \
+                page.fast_req_t == fastest.fast_req_t and \
+                page.last > fastest.last:
+            self.fastest = page
+        slowest = self.slowest
+        if slowest is None or page.slow_req_t > slowest.slow_req_t or \
+                page.slow_req_t == slowest.slow_req_t and \
+                page.last > slowest.last:
+            self.slowest = page
+
+    def _merge_browsers(self, counts):
+        """Добавляет счётчики [(browser, count), ...]"""
+        browsers = self._browsers
+        board = self._top_browsers
+        for browser, count in counts:
+            if browser in browsers:
+                count = browsers[browser] = browsers[browser] + count
+            else:
+                browsers[browser] = count
+            if count >= board.threshold:
+                board.update(browser, count)
+
+    def _merge_clients(self, counts):
+        """Добавляет счётчики [(ip, count), ...]"""
+        clients = self._clients
+        board = self._top_clients
+        for name, count in counts:
+            if name in clients:
+                client = clients[name]
+                client['count'] += count
+            else:
+                client = clients[name] = {'count': count}
+            if client['count'] >= board.threshold:
+                board.update(name, client['count'])
+
+    def _merge_day(self, date, counts):
+        """Добавляет счётчики клиентов дня [(ip, count), ...] в порядке их
+        первой встречи"""
+        if date not in self._days:
+            self._days[date] = dict()
+        day = self._days[date]
+        seqs = self._day_seqs.get(date)
+        names = []
+        for name, count in counts:
+            names.append(name)
+            if name in day:
+                day[name] += count
+            else:
+                day[name] = count
+                if seqs is not None:
+                    seqs[name] = len(seqs)
+
+        # лидер дня - прежний или один из добавленных клиентов
+        leader = self.macs.get(date)
+        for name in names:
+            if leader is None or day[name] > day[leader] or \
+                    day[name] == day[leader] and name != leader and \
+                    self._added_before(date, name, leader):
+                leader = name
+        self.macs[date] = leader
+
+    def add_from_stdin(self):
+        self.add_lines(sys.stdin)
 
-    def _upd_the_most_popular_page(self, page):
-        if self.most_popular_page is None:
-            self.most_popular_page = page
+    def add_from_file(self, path, start=0, end=None):
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                self.add_from_buffer(buf, start, end)
+
+    def add_from_archive(self, path, processes=None):
+        """Разбирает сжатый (bz2, gzip, xz) или обычный файл, не распаковывая
+        его целиком в память"""
+        rest = b''
+        blocks = decompressed_blocks(path, processes)
+        while True:
+            wait = perf_counter()
+            block = next(blocks, None)
+            if self.instrument is not None:
+                self.instrument.io_seconds += perf_counter() - wait
+            if block is None:
+                break
+            data = rest + block
+            end = data.rfind(b'\n') + 1
+            self.add_from_buffer(data, 0, end)
+            rest = data[end:]
+        if rest:
+            self.add_from_buffer(rest)
+
+    def add_from_buffer(self, buf, start=0, end=None):
+        """Разбирает строки буфера байт `buf` в диапазоне [start, end) так же,
+        как `add_from_stdin` разбирал бы их текст. Байтовые значения полей
+        декодируются только при первой встрече"""
+        if self.log_format is not None:
+            return self._add_decoded_lines(buf, start, end)
+        ips = {}
+        dates = {}
+        names = {}
+        agents = {}
+        codes = {}
+        match = bytes_pattern.match
+        end = len(buf) if end is None else end
+        timed = self.timed
+        rejected = 0
+        for pos, eol in line_spans(buf, start, end):
+            log = match(buf, pos, eol)
+            if not log:
+                rejected += 1
+                continue
+
+            ip, time, clock, name, code, agent, req_time = log.group(
+                *field_names)
+            if name not in names:
+                names[name] = name.decode('utf-8', 'surrogateescape')
+                if self.normalizer is not None:
+                    names[name] = self.normalizer.normalize(names[name])
+            if agent not in agents:
+                agents[agent] = agent.decode('utf-8', 'surrogateescape')
+            if ip not in ips:
+                ips[ip] = ip.decode('utf-8', 'surrogateescape')
+            if time not in dates:
+                dates[time] = self._get_date(time.decode('ascii'))
+            if code not in codes:
+                codes[code] = code.decode('ascii')
+
+            self._add(ips[ip], dates[time], clock, names[name], codes[code],
+                      agents[agent], req_time)
+
+        if self.instrument is not None:
+            self.instrument.count_buffer(count_lines(buf, start, end),
+                                         rejected, self.timed - timed)
+
+    def _add_decoded_lines(self, buf, start, end):
+        """Строки буфера для `log_format`: декодируются целиком и разбираются
+        через `add_line`"""
+        add_line = self.add_line
+        for pos, eol in line_spans(buf, start, end):
+            add_line(buf[pos:eol].decode('utf-8', 'surrogateescape') + '\n')
+
+    def add_lines(self, lines):
+        """Как `add_line` для каждой строки `lines` (строки с '\\n' на
+        конце), но без поиска атрибутов и вызова методов на каждую строку.
+        Буфер байт разбирается `add_from_buffer`"""
+        if isinstance(lines, (bytes, bytearray, mmap.mmap)):
+            return self.add_from_buffer(lines)
+        if self.instrument is not None:
+            for line in lines:
+                self.add_line(line)
             return
 
-        if page.count > self.most_popular_page.count:
-            self.most_popular_page = page
-        elif page.count == self.most_popular_page.count:
-            if page.name < self.most_popular_page.name:
-                self.most_popular_page = page
+        parse = self.parse_line
+        # parse_line - это `pattern`; его группы разбираются здесь же, а
+        # endpos вместо line[:-1] не копирует строку
+        match = pattern.match if parse is parse_line else None
+        get_date = self._get_date
+        last_time = self._last_time
+        last_date = self._last_date
+        add = self._add
+        try:
+            for line in lines:
+                if match is not None:
+                    log = match(line, 0, len(line) - 1)
+                    if log is None:
+                        continue
+                    ip, time, clock, _, name, code, agent, req_time, _ = \
+                        log.groups('')
+                else:
+                    fields = parse(line[:-1])
+                    if not fields:
+                        continue
+                    ip, time, clock, name, code, agent, req_time = fields
+                if time != last_time:
+                    last_date = get_date(time)
+                    last_time = time
+                add(ip, last_date, clock, name, code, agent, req_time)
+        finally:
+            self._last_time = last_time
+            self._last_date = last_date
+
+    def add_line(self, line):
+        fields = self.parse_line(line[:-1])
+        if fields:
+            ip, time, clock, name, code, agent, req_time = fields
+            if time != self._last_time:
+                self._last_date = self._get_date(time)
+                self._last_time = time
+            self._add(ip, self._last_date, clock, name, code, agent,
+                      req_time)
+
+    def _add_line_instrumented(self, line):
+        metrics = self.instrument
+        metrics.lines += 1
+        if metrics.lines % metrics.sample_every:
+            fields = self.parse_line(line[:-1])
+            if fields:
+                metrics.matched += 1
+                ip, time, clock, name, code, agent, req_time = fields
+                if not req_time:
+                    metrics.no_req_time += 1
+                if time != self._last_time:
+                    self._last_date = self._get_date(time)
+                    self._last_time = time
+                self._add(ip, self._last_date, clock, name, code, agent,
+                          req_time)
+            else:
+                metrics.rejected += 1
+            if not (metrics.lines + 1) % metrics.sample_every:
+                metrics.mark = perf_counter()
+            return
 
-    def _upd_the_most_active_client(self, name, client):
-        if self.most_active_client is None:
-            self.most_active_client = name
+        # замеряемая строка: тот же разбор, но по этапам
+        seconds = metrics.seconds
+        metrics.sampled += 1
+        start = perf_counter()
+        if metrics.mark is not None:
+            seconds['io'] += start - metrics.mark
+        fields = self.parse_line(line[:-1])
+        parsed = perf_counter()
+        seconds['parse'] += parsed - start
+        if not fields:
+            metrics.rejected += 1
             return
+        metrics.matched += 1
+        ip, time, clock, name, code, agent, req_time = fields
+        if not req_time:
+            metrics.no_req_time += 1
+        if time != self._last_time:
+            self._last_date = self._get_date(time)
+            self._last_time = time
+        date = self._last_date
+        stages = self._stages
+        dated = perf_counter()
+        page = stages['page'](name, req_time, agent)
+        paged = perf_counter()
+        stages['client'](ip, date)
+        clients = perf_counter()
+        stages['extra'](page, ip, date, clock, name, code, req_time)
+        done = perf_counter()
+        seconds['date'] += dated - parsed
+        seconds['page'] += paged - dated
+        seconds['client'] += clients - paged
+        seconds['extra'] += done - clients
 
-        if client['count'] > self._clients[self.most_active_client]['count']:
-            self.most_active_client = name
-        elif client['count'] == \
-                self._clients[self.most_active_client]['count']:
-            if name < self.most_active_client:
-                self.most_active_client = name
+    def metrics(self):
+        """Счётчики и замеры инструментирования (см. `Instrument.snapshot`),
+        можно вызывать во время разбора"""
+        if self.instrument is None:
+            return None
+        return self.instrument.snapshot()
 
-    def _upd_the_most_popular_browser(self, browser):
-        if self.popular_browser is None:
-            self.popular_browser = browser
+    def _add_spilling(self, ip, date, clock, name, code, agent, req_time):
+        self._add_unspilled(ip, date, clock, name, code, agent, req_time)
+        self._spill_countdown -= 1
+        if not self._spill_countdown:
+            self._spill_countdown = self.spill_check_every
+            self._spill_if_needed()
+
+    def _spill_if_needed(self):
+        keys = len(self._pages) + len(self._clients) + \
+            sum(map(len, self._days.values()))
+        if keys < self.spill.max_keys:
             return
 
-        if self._browsers[browser] > self._browsers[self.popular_browser]:
-            self.popular_browser = browser
-        elif self._browsers[browser] == \
-                self._browsers[self.popular_browser]:
-            if browser < self.popular_browser:
-                self.popular_browser = browser
+        self.spill.write(self._pages, self._clients, self._days)
+        self._pages = {}
+        self._clients = {}
+        self._days = {}
+        self._day_seqs = {}
+        # порядок дат остаётся, лидеры дней считаются заново
+        self.macs = dict.fromkeys(self.macs)
+        self._top_pages = Leaderboard(self.top)
+        self._top_clients = Leaderboard(self.top)
+        self._slowest_avg = SlowestAverage()
 
-    def _get_the_most_active_clients_by_days(self):
-        for day in self._days.items():
-            self.macs[day[0]] = max(day[1], key=lambda n: day[1][n])
+    def _reduce_spilled(self):
+        """Результаты по страницам и клиентам со сброшенными агрегатами:
+        каждая часть `spill` вместе с данными в памяти из этой части
+        сводится отдельно, затем из лидеров частей выбираются общие"""
+        fastest = slowest = slowest_avg = slowest_p99 = None
+        top_pages = Leaderboard(self.top)
+        top_clients = Leaderboard(self.top)
+        pages = {}  # {name: Page, ...} лидеров частей
+        macs = dict(self.macs)
+        percentiles = {}
+        visitors = {}
+        memory = self.spill.split(self._pages, self._clients, self._days)
+        for i in range(self.spill.partitions):
+            part = LogStat(self.percentiles, self.distinct_clients,
+                           top=self.top)
+            for partial in itertools.chain(self.spill.read(i), [memory[i]]):
+                part._merge_partial(*partial)
+            part._rebuild_leaders()
 
-    def add_from_stdin(self):
-        for line in sys.stdin:
-            self.add_line(line)
+            for name, count in part._top_pages.leaders():
+                top_pages.update(name, count)
+                pages[name] = part._pages[name]
+            for name, count in part._top_clients.leaders():
+                top_clients.update(name, count)
+            macs.update(part.macs)
+            if self.distinct_clients:
+                visitors.update((page.name, page.visitors.count())
+                                for page in part._pages.values())
+            if part.fastest is None:
+                continue
 
-    def add_line(self, line):
-        log = pattern.match(line[:-1])
-        if log:
-            self._add_page(log)
-            self._add_client(log)
+            if fastest is None or \
+                    (part.fastest.fast_req_t, -part.fastest.last) < \
+                    (fastest.fast_req_t, -fastest.last):
+                fastest = part.fastest
+            if slowest is None or \
+                    (part.slowest.slow_req_t, part.slowest.last) > \
+                    (slowest.slow_req_t, slowest.last):
+                slowest = part.slowest
+            page = part._slowest_avg.find(part._pages)
+            if slowest_avg is None or page.avg > slowest_avg.avg or \
+                    page.avg == slowest_avg.avg and page.num < slowest_avg.num:
+                slowest_avg = page
+            if self.percentiles:
+                table = part._percentile_results()['Percentiles']
+                percentiles.update(table)
+                # при равенстве - страница с меньшим номером, как в памяти
+                for name, (_, _, p99) in table.items():
+                    page = part._pages[name]
+                    if slowest_p99 is None or (p99, -page.num) > \
+                            (slowest_p99[1], -slowest_p99[0].num):
+                        slowest_p99 = (page, p99)
+
+        self.fastest = fastest
+        self.slowest = slowest
+        self.slowest_avg = slowest_avg
+        self.slowest_p99 = slowest_p99
+        self.most_popular_page = pages.get(top_pages.leader())
+        self.most_active_client = top_clients.leader()
+        results = {'MostActiveClientByDay': macs}
+        if self.percentiles:
+            results['SlowestP99Page'] = slowest_p99 and slowest_p99[0].name
+            results['Percentiles'] = percentiles
+        if self.distinct_clients:
+            results['DistinctClientsByPage'] = visitors
+        if self.top > 1:
+            results['TopPages'] = top_pages.leaders()
+            results['TopClients'] = top_clients.leaders()
+        return results
 
-    def _add_page(self, log):
-        name = log.group('name')
-        req_time = log.group('req_time')
+    def _merge_partial(self, pages, clients, days):
+        """Добавляет частичные агрегаты из `Spill`: у страницы остаются
+        номер первой встречи и последняя строка со временем обработки"""
+        for other in pages:
+            page = self._pages.get(other.name)
+            if page is None:
+                self._pages[other.name] = other
+                continue
+            page.merge(other)
+            page.num = min(page.num, other.num)
+            page.last = max(page.last, other.last)
+        for name, count in clients:
+            if name in self._clients:
+                self._clients[name]['count'] += count
+            else:
+                self._clients[name] = {'count': count}
+        for date, clients in days.items():
+            day = self._days.setdefault(date, {})
+            for name, count in clients.items():
+                day[name] = day.get(name, 0) + count
+
+    def _add_page(self, name, req_time, browser):
 
         if name in self._pages:
             page = self._pages[name]
             page.upd_page(req_time)
         else:
-            page = self._pages[name] = Page(name, req_time, self.num)
+            page = self._pages[name] = self.page_class(
+                name, req_time, self.num,
+                QuantileSketch() if self.percentiles else None)
             self.num += 1
+        if page.count >= self._top_pages.threshold:
+            self._top_pages.update(name, page.count)
 
         if req_time:
+            self.timed += 1
+            page.last = self.timed
             self._upd_the_fastest_page(page)
             self._upd_the_slowest_page(page)
-            self._upd_the_slowest_avg_page(page)
+        if page.last != -1:
+            self._slowest_avg.dirty.add(page)
 
-        browser = log.group('agent')
+        if browser is not None:
+            self._add_browser(browser)
+        return page
 
+    def _add_browser(self, browser):
         if browser in self._browsers:
             self._browsers[browser] += 1
         else:
             self._browsers[browser] = 1
+        if self._browsers[browser] >= self._top_browsers.threshold:
+            self._top_browsers.update(browser, self._browsers[browser])
 
-    def _add_client(self, log):
-        name = log.group('ip')
-        date = self._get_date(log.group('time'))
-        if date not in self._days:
-            self._days[date] = dict()
-
+    def _add_client(self, name, date):
         if name in self._clients:
             client = self._clients[name]
             client['count'] += 1
         else:
-            self._clients[name] = {
+            name = self.intern(name)
+            client = self._clients[name] = {
                 'count': 1
             }
+        if client['count'] >= self._top_clients.threshold:
+            self._top_clients.update(name, client['count'])
 
-        self._add_to_days(name, date)
+        if date is not None:
+            self._add_to_days(name, date)
 
     def _add_to_days(self, name, date):
-        if name in self._days[date]:
-            self._days[date][name] += 1
+        if date not in self._days:
+            self._days[date] = dict()
+        day = self._days[date]
+        if name in day:
+            count = day[name] = day[name] + 1
         else:
-            self._days[date][name] = 1
+            name = self.intern(name)
+            count = day[name] = 1
+            seqs = self._day_seqs.get(date)
+            if seqs is not None:
+                seqs[name] = len(seqs)
+
+        # лидер дня - первый добавленный из клиентов с наибольшим счётчиком
+        leader = self.macs.get(date)
+        if leader is None:
+            self.macs[date] = name
+        elif count >= day[leader] and name != leader:
+            if count > day[leader] or self._added_before(date, name, leader):
+                self.macs[date] = name
+
+    def _added_before(self, date, name, other):
+        seqs = self._day_seqs.get(date)
+        if seqs is None:
+            # ключи дня не удаляются, поэтому порядок словаря - порядок
+            # добавления
+            seqs = self._day_seqs[date] = dict(zip(self._days[date],
+                                                    itertools.count()))
+        return seqs[name] < seqs[other]
+
+    def _add_visitor(self, page, name, date):
+        name_hash = HyperLogLog.hash(name)
+        if page.visitors is None:
+            page.visitors = HyperLogLog(self.page_hll_precision)
+        page.visitors.add_hash(name_hash)
+
+        if date not in self._day_visitors:
+            self._day_visitors[date] = HyperLogLog(self.day_hll_precision)
+        self._day_visitors[date].add_hash(name_hash)
 
     @staticmethod
     def _get_date(log_time):
@@ -203,31 +1061,82 @@ class LogStat:
                              int(months.index(date_array[1])) + 1,
                              int(date_array[0]))
 
+    def _is_empty(self):
+        """Нет строк для результатов: если нужны страницы и в формате есть
+        время обработки - нет ни одной строки с ним"""
+        if self._need_pages and self._timed:
+            return self.fastest is None
+        return not (self._pages or self._clients or self._days or
+                    self._browsers)
+
     def results(self):
-        if self.fastest is None:
+        if self._is_empty():
             self.add_from_stdin()
 
-        for page_name in self._pages:
-            page = self._pages[page_name]
-            self._upd_the_most_popular_page(page)
-
-        for client_name in self._clients:
-            client = self._clients[client_name]
-            self._upd_the_most_active_client(client_name, client)
+        spilled = None  # результаты, посчитанные по частям
+        if self.spill is not None and self.spill.spills:
+            spilled = self._reduce_spilled()
+        else:
+            if self._need_pages:
+                self.most_popular_page = \
+                    self._pages[self._top_pages.leader()]
+                self.slowest_avg = self._slowest_avg.find(self._pages)
+            self.most_active_client = self._top_clients.leader()
+        self.popular_browser = self._top_browsers.leader()
 
-        for browser in self._browsers:
-            self._upd_the_most_popular_browser(browser)
+        results = {}
+        if self._need_pages:
+            # None, если ни у одной страницы нет времени обработки
+            results['FastestPage'] = self.fastest and self.fastest.name
+        results['MostActiveClient'] = self.most_active_client
+        results['MostActiveClientByDay'] = self.macs
+        results['MostPopularBrowser'] = self.popular_browser
+        if self._need_pages:
+            results['MostPopularPage'] = self.most_popular_page.name
+            results['SlowestAveragePage'] = \
+                self.slowest_avg and self.slowest_avg.name
+            results['SlowestPage'] = self.slowest and self.slowest.name
+        if self.percentiles and spilled is None:
+            results.update(self._percentile_results())
+        if self.distinct_clients:
+            results['DistinctClientsByDay'] = {
+                date: visitors.count()
+                for date, visitors in self._day_visitors.items()}
+            results['DistinctClientsByPage'] = {
+                page.name: page.visitors.count()
+                for page in self._pages.values()}
+        if self.top > 1:
+            results['TopPages'] = self._top_pages.leaders()
+            results['TopClients'] = self._top_clients.leaders()
+            results['TopBrowsers'] = self._top_browsers.leaders()
+        if spilled is not None:
+            results.update(spilled)
+        if self.only is not None:
+            results = {key: value for key, value in results.items()
+                       if key in self.only or key not in self.result_needs}
+        if self.rollup is not None:
+            results.update(self.rollup.results())
+        if self.windows is not None:
+            results['Windows'] = self.windows.results()
+        if self.sessions is not None:
+            results.update(self.sessions.results())
+        if self.instrument is not None:
+            results['Metrics'] = self.metrics()
+        return results
 
-        self._get_the_most_active_clients_by_days()
+    def _percentile_results(self):
+        table = {}  # {name: (p50, p95, p99), ...}
+        self.slowest_p99 = None
+        for page in self._pages.values():
+            if page.last == -1:
+                continue
+            table[page.name] = tuple(page.sketch.quantile(q)
+                                     for q in (0.5, 0.95, 0.99))
+            self._upd_the_slowest_p99_page(page, table[page.name][2])
 
         return {
-            'FastestPage': self.fastest.name,
-            'MostActiveClient': self.most_active_client,
-            'MostActiveClientByDay': self.macs,
-            'MostPopularBrowser': self.popular_browser,
-            'MostPopularPage': self.most_popular_page.name,
-            'SlowestAveragePage': self.slowest_avg.name,
-            'SlowestPage': self.slowest.name
+            'SlowestP99Page': self.slowest_p99 and self.slowest_p99[0].name,
+            'Percentiles': table
         }
 
 
@@ -319,12 +1228,12 @@ class LogStatTests(unittest.TestCase):
         self.assertTrue(page.avg == page.req_times == 3376692)
 
     def test_slowest_avg(self):
-        self.stat.slowest_avg = Page('fast', 170, 1)
-        slow_page = Page('slow', 170, 0)
-
-        self.stat._upd_the_slowest_avg_page(slow_page)
+        self.stat._pages = {'fast': Page('fast', 170, 1),
+                            'slow': Page('slow', 170, 0)}
+        self.stat._slowest_avg.dirty.update(self.stat._pages.values())
 
-        self.assertEqual(self.stat.slowest_avg.name, 'slow')
+        self.assertEqual(
+            self.stat._slowest_avg.find(self.stat._pages).name, 'slow')
 
     # def test_from_example_3(self):
     #     self.make_data('ftp://shannon.usu.edu.ru/python/hw4/v2/examples'
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+import time
+
+stages = ('io', 'parse', 'date', 'page', 'client', 'extra')
+
+
+class Instrument:
+    """Счётчики строк и выборочные замеры времени этапов разбора. Время
+    замеряется у каждой `sample_every`-й строки, остальные строки только
+    считаются"""
+
+    def __init__(self, sample_every=1000):
+        self.sample_every = sample_every
+        self.lines = 0
+        self.matched = 0
+        self.rejected = 0
+        self.no_req_time = 0
+        self.sampled = 0
+        self.seconds = dict.fromkeys(stages, 0.0)  # сумма по замерам
+        self.io_seconds = 0.0  # ожидание блоков в add_from_archive
+        self.started = time.perf_counter()
+        self.mark = None  # конец строки перед замеряемой
+
+    def count_buffer(self, lines, rejected, timed):
+        self.lines += lines
+        self.rejected += rejected
+        self.matched += lines - rejected
+        self.no_req_time += lines - rejected - timed
+
+    def merge(self, other):
+        for name in ('lines', 'matched', 'rejected', 'no_req_time', 'sampled',
+                     'io_seconds'):
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        for stage, seconds in other.seconds.items():
+            self.seconds[stage] += seconds
+
+    def snapshot(self):
+        """Текущие значения: счётчики, среднее время этапа на строку по
+        замерам и оценка полного времени этапа"""
+        per_line = {stage: seconds / self.sampled if self.sampled else 0.0
+                    for stage, seconds in self.seconds.items()}
+        return {
+            'lines': self.lines,
+            'matched': self.matched,
+            'rejected': self.rejected,
+            'no_req_time': self.no_req_time,
+            'sampled': self.sampled,
+            'per_line': per_line,
+            'estimated': {stage: seconds * self.lines
+                          for stage, seconds in per_line.items()},
+            'archive_io': self.io_seconds,
+            'elapsed': time.perf_counter() - self.started
+        }
+
+
+def count_lines(buf, start, end):
+    """Количество строк в [start, end) буфера, последняя может быть без
+    '\\n'"""
+    lines = 0
+    pos = start
+    while pos < end:
+        eol = buf.find(b'\n', pos, end)
+        if eol == -1:
+            return lines + 1
+        lines += 1
+        pos = eol + 1
+    return lines
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+import heapq
+
+
+class Leaderboard:
+    """`size` ключей с наибольшими счётчиками; при равных счётчиках выше
+    лексикографически меньший ключ. Счётчики только растут, поэтому ключ
+    вне таблицы достаточно сравнить с худшим ключом таблицы: если счётчик
+    меньше `threshold`, `update` можно не вызывать"""
+    __slots__ = ('size', 'top', 'threshold', '_worst')
+
+    def __init__(self, size=1):
+        self.size = size
+        self.top = {}  # {key: count, ...}
+        self.threshold = 0  # счётчик худшего ключа, пока таблица не полна - 0
+        self._worst = None
+
+    def update(self, key, count):
+        """Счётчик `key` вырос до `count`"""
+        top = self.top
+        if key in top:
+            top[key] = count
+            if key == self._worst:
+                self._find_worst()
+        elif len(top) < self.size:
+            top[key] = count
+            self._find_worst()
+        elif count > self.threshold or \
+                count == self.threshold and key < self._worst:
+            del top[self._worst]
+            top[key] = count
+            self._find_worst()
+
+    def _find_worst(self):
+        top = self.top
+        if len(top) == 1:
+            self._worst = next(iter(top))
+        else:
+            self._worst = max(top, key=lambda key: (-top[key], key))
+        if len(top) == self.size:
+            self.threshold = top[self._worst]
+
+    def rebuild(self, counts):
+        """Заново заполняет таблицу по словарю {key: count, ...}"""
+        self.top = dict(heapq.nsmallest(
+            self.size, counts.items(), key=lambda item: (-item[1], item[0])))
+        self.threshold = 0
+        self._worst = None
+        if self.top:
+            self._find_worst()
+
+    def leaders(self):
+        """[(key, count), ...] от лучшего к худшему"""
+        return sorted(self.top.items(), key=lambda item: (-item[1], item[0]))
+
+    def leader(self):
+        if self.size == 1:
+            return next(iter(self.top), None)
+        return min(self.top, key=lambda key: (-self.top[key], key),
+                   default=None)
+
+
+class SlowestAverage:
+    """Страница с наибольшим средним временем обработки (при равенстве -
+    с меньшим номером). Изменившиеся страницы копятся в `dirty` и попадают
+    в кучу при запросе, устаревшие записи кучи отбрасываются лениво"""
+
+    def __init__(self):
+        self.dirty = set()
+        self._heap = []  # [(-avg, num, name), ...]
+
+    def rebuild(self, pages):
+        self.dirty = set()
+        self._heap = [(-page.avg, page.num, page.name)
+                      for page in pages.values() if page.last != -1]
+        heapq.heapify(self._heap)
+
+    def find(self, pages):
+        """Текущая страница из `pages` ({name: Page}) или None"""
+        if len(self._heap) + len(self.dirty) > 2 * len(pages) + 64:
+            self.rebuild(pages)
+        heap = self._heap
+        for page in self.dirty:
+            heapq.heappush(heap, (-page.avg, page.num, page.name))
+        self.dirty.clear()
+
+        while heap:
+            avg, _, name = heap[0]
+            if pages[name].avg == -avg:
+                return pages[name]
+            heapq.heappop(heap)
+        return None
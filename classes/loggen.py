@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+import sys
+import random
+import datetime
+
+from hw5_stripped import months
+
+methods = ['GET', 'GET', 'GET', 'POST', 'HEAD', 'PUT', 'OPTIONS', 'DELETE']
+codes = ['200', '200', '200', '200', '304', '301', '404', '500']
+browsers = ['Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.{0} '
+            '(KHTML, like Gecko) Chrome/24.0.{0}.57 Safari/537.17',
+            'Mozilla/4.0 (compatible; MSIE {0}.0; Windows NT 6.1; '
+            'Trident/5.0; SLCC2; .NET CLR 2.0.50727; .NET4.0C)',
+            'Mozilla/5.0 (X11; Linux x86_64; rv:{0}.0) Gecko/20100101 '
+            'Firefox/{0}.0']
+
+
+def generate(lines=100000, pages=1000, clients=100, agents=20,
+             malformed=0.01, no_req_time=0.1, seed=0,
+             start=datetime.datetime(2013, 2, 17), step=1.0):
+    """Генератор строк лога (с '\\n' на конце). Одинаковые параметры дают
+    одинаковые строки. Имена страниц, клиенты и браузеры выбираются из
+    `pages`, `clients` и `agents` вариантов, доля `malformed` строк
+    некорректна, а у доли `no_req_time` нет времени обработки. Между
+    соседними строками проходит `step` секунд"""
+    rnd = random.Random(seed)
+    agent_names = [browsers[i % len(browsers)].format(i)
+                   for i in range(agents)]
+    second = datetime.timedelta(seconds=step)
+    moment = start
+    for _ in range(lines):
+        moment += second
+        page = rnd.randrange(pages)
+        client = rnd.randrange(clients)
+        line = '10.{0}.{1}.{2} - - [{3} +0600] "{4} /page/{5}?id={6} ' \
+               'HTTP/1.1" {7} {8} "http://example.com/{9}" "{10}"'.format(
+                   client >> 16 & 255, client >> 8 & 255, client & 255,
+                   '{0:02}/{1}/{2}:{3:%H:%M:%S}'.format(
+                       moment.day, months[moment.month - 1], moment.year,
+                       moment),
+                   rnd.choice(methods), page % 97, page,
+                   rnd.choice(codes), rnd.randrange(100000),
+                   rnd.randrange(pages), rnd.choice(agent_names))
+        if rnd.random() >= no_req_time:
+            line += ' {0}'.format(int(rnd.expovariate(1 / 5000)) + 1)
+        if rnd.random() < malformed:
+            line = _break(rnd, line)
+        yield line + '\n'
+
+
+def _break(rnd, line):
+    kind = rnd.randrange(4)
+    if kind == 0:
+        return line[:rnd.randrange(len(line))]
+    if kind == 1:
+        return line.replace('HTTP/1.1"', 'HTTP/1.1', 1)
+    if kind == 2:
+        return line.replace(' - - ', ' -- ', 1)
+    return line.replace('"GET', '"FETCH', 1).replace('"POST', '"FETCH', 1)
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    sys.stdout.writelines(generate(count))
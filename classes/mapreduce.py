@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+import pprint
+import argparse
+
+from hw5_stripped import LogStat
+
+
+def merge_tree(stats):
+    """Склеивает статистики кусков, идущих в логе друг за другом, попарно:
+    соседние пары, затем пары пар и так далее, так что каждая статистика
+    участвует не более чем в log2(n) склейках"""
+    stats = list(stats)
+    if not stats:
+        return LogStat()
+    while len(stats) > 1:
+        merged = []
+        for i in range(0, len(stats) - 1, 2):
+            stats[i].merge(stats[i + 1])
+            merged.append(stats[i])
+        if len(stats) % 2:
+            merged.append(stats[-1])
+        stats = merged
+    return stats[0]
+
+
+def read_stat(path):
+    with open(path, 'rb') as f:
+        return LogStat.load(f.read())
+
+
+def write_stat(stat, path):
+    with open(path, 'wb') as f:
+        f.write(stat.dump())
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Частичные статистики LogStat по файлам и их склейка')
+    commands = parser.add_subparsers(dest='command', required=True)
+    map_parser = commands.add_parser(
+        'map', help='статистика по файлу лога (или архиву) в файл состояния')
+    map_parser.add_argument('log')
+    map_parser.add_argument('output')
+    map_parser.add_argument('--archive', action='store_true')
+    reduce_parser = commands.add_parser(
+        'reduce', help='склейка файлов состояния в порядке следования логов')
+    reduce_parser.add_argument('output')
+    reduce_parser.add_argument('inputs', nargs='+')
+    results_parser = commands.add_parser(
+        'results', help='результаты по файлу состояния')
+    results_parser.add_argument('input')
+    args = parser.parse_args()
+
+    if args.command == 'map':
+        stat = LogStat()
+        if args.archive:
+            stat.add_from_archive(args.log)
+        else:
+            stat.add_from_file(args.log)
+        write_stat(stat, args.output)
+    elif args.command == 'reduce':
+        write_stat(merge_tree(map(read_stat, args.inputs)), args.output)
+    else:
+        pprint.pprint(read_stat(args.input).results())
+
+
+if __name__ == '__main__':
+    main()
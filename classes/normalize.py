@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+import re
+
+re_uuid = re.compile(r'[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-'
+                     r'[0-9a-fA-F]{4}-[0-9a-fA-F]{12}\Z')
+inherit = object()  # у узла нет своего правила для параметров
+
+
+class Node:
+    __slots__ = ('children', 'keep')
+
+    def __init__(self):
+        self.children = {}  # {сегмент пути: Node, ...}
+        self.keep = inherit
+
+
+class Normalizer:
+    """Приводит имена страниц к шаблонам, чтобы страницы с разными
+    параметрами считались одной.
+
+    Из строки запроса остаются только параметры из `keep` (None - строка
+    запроса не меняется, пустой набор - отбрасывается целиком). Для путей с
+    префиксами из `prefixes` ({'/api/search': ('q',), ...}) набор задаётся
+    отдельно, действует самый длинный префикс; префиксы хранятся в дереве
+    по сегментам пути. Если `collapse`, числовые сегменты пути заменяются на
+    '{int}', а UUID - на '{uuid}' (так их можно писать и в префиксах).
+    Результаты запоминаются для последних не более `memo_size` имён"""
+
+    def __init__(self, keep=(), prefixes=None, collapse=True,
+                 memo_size=1 << 16):
+        self.keep = None if keep is None else frozenset(keep)
+        self.collapse = collapse
+        self.memo_size = memo_size
+        self._root = Node()
+        self._root.keep = self.keep
+        self._memo = {}  # {имя: шаблон, ...}
+        self.prefixes = {}  # {префикс: frozenset или None, ...}
+        for prefix, keep in (prefixes or {}).items():
+            node = self._root
+            for segment in filter(None, prefix.split('/')):
+                node = node.children.setdefault(segment, Node())
+            node.keep = self.prefixes[prefix] = \
+                None if keep is None else frozenset(keep)
+
+    def normalize(self, name):
+        template = self._memo.get(name)
+        if template is None:
+            if len(self._memo) >= self.memo_size:
+                self._memo.clear()
+            template = self._memo[name] = self._normalize(name)
+        return template
+
+    def _normalize(self, name):
+        path, sep, query = name.partition('?')
+        segments = path.split('/')
+        if self.collapse:
+            segments = [self._collapse(segment) for segment in segments]
+            path = '/'.join(segments)
+
+        node = self._root
+        keep = node.keep
+        for segment in segments[1:]:
+            node = node.children.get(segment)
+            if node is None:
+                break
+            if node.keep is not inherit:
+                keep = node.keep
+
+        if keep is None or not sep:
+            return path + sep + query
+        query = '&'.join(param for param in query.split('&')
+                         if param.partition('=')[0] in keep)
+        return path + '?' + query if query else path
+
+    @staticmethod
+    def _collapse(segment):
+        if segment.isdigit():
+            return '{int}'
+        if len(segment) == 36 and re_uuid.match(segment):
+            return '{uuid}'
+        return segment
+
+    def parser(self, parse):
+        """Функция разбора строки, как `parse`, но с шаблоном вместо имени
+        страницы"""
+        normalize = self.normalize
+
+        def parse_normalized(line):
+            fields = parse(line)
+            if fields:
+                ip, time, clock, name, code, agent, req_time = fields
+                return (ip, time, clock, normalize(name), code, agent,
+                        req_time)
+            return fields
+        return parse_normalized
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+import os
+import sys
+import pprint
+from multiprocessing import Pool
+
+from hw5_stripped import LogStat
+
+
+def split_file(path, parts):
+    """Разбивает файл на не более чем `parts` диапазонов байт (начало, конец),
+    границы которых совпадают с началами строк"""
+    size = os.path.getsize(path)
+    bounds = [0]
+    with open(path, 'rb') as f:
+        for i in range(1, parts):
+            pos = size * i // parts
+            if pos <= bounds[-1]:
+                continue
+            f.seek(pos - 1)
+            f.readline()
+            pos = f.tell()
+            if bounds[-1] < pos < size:
+                bounds.append(pos)
+    bounds.append(size)
+    return list(zip(bounds, bounds[1:]))
+
+
+def stat_chunk(chunk):
+    path, start, end, options = chunk
+    stat = LogStat(**options)
+    stat.add_from_file(path, start, end)
+    return stat
+
+
+def parallel_stat(path, processes=None, **options):
+    """Считает статистику по файлу `path` в `processes` процессах и склеивает
+    частичные результаты в порядке следования кусков файла. `options`
+    передаются в конструктор `LogStat`"""
+    processes = processes or os.cpu_count()
+    chunks = [(path, start, end, options)
+              for start, end in split_file(path, processes * 4)]
+    stat = LogStat(**options)
+    with Pool(processes) as pool:
+        for part in pool.imap(stat_chunk, chunks):
+            stat.merge(part)
+    return stat
+
+
+if __name__ == '__main__':
+    pprint.pprint(parallel_stat(
+        sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else None
+    ).results())
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+import math
+
+
+class QuantileSketch:
+    """Логарифмическая гистограмма значений: квантиль возвращается с
+    относительной ошибкой не больше `accuracy`, а число корзин ограничено
+    `max_buckets` (при переполнении склеиваются самые маленькие значения).
+    Гистограммы можно складывать"""
+    __slots__ = ('buckets', 'zeros', 'count')
+
+    accuracy = 0.01
+    gamma = (1 + accuracy) / (1 - accuracy)
+    log_gamma = math.log(gamma)
+    max_buckets = 1024
+
+    def __init__(self):
+        self.buckets = {}  # {номер корзины: количество, ...}
+        self.zeros = 0
+        self.count = 0
+
+    def add(self, value, count=1):
+        self.count += count
+        if value <= 0:
+            self.zeros += count
+            return
+
+        key = math.ceil(math.log(value) / self.log_gamma)
+        if key in self.buckets:
+            self.buckets[key] += count
+        else:
+            self.buckets[key] = count
+            if len(self.buckets) > self.max_buckets:
+                self._collapse()
+
+    def _collapse(self):
+        first, second = sorted(self.buckets)[:2]
+        self.buckets[second] += self.buckets.pop(first)
+
+    def merge(self, other):
+        self.count += other.count
+        self.zeros += other.zeros
+        for key, count in other.buckets.items():
+            if key in self.buckets:
+                self.buckets[key] += count
+            else:
+                self.buckets[key] = count
+        while len(self.buckets) > self.max_buckets:
+            self._collapse()
+
+    def quantile(self, q):
+        if self.count == 0:
+            return None
+
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return 0
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if rank < seen:
+                return 2 * self.gamma ** key / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
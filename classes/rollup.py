@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+import datetime
+
+
+class Rollup:
+    """Временные ряды по минутам и по часам: для каждой минуты хранится
+    [запросов, запросов со временем обработки, сумма времён, ошибок 4xx/5xx],
+    часы складываются из минут при выдаче результата. Соседние строки лога
+    обычно попадают в одну минуту, поэтому разбор времени и поиск корзины
+    запоминаются для последнего префикса времени"""
+
+    def __init__(self):
+        self.minutes = {}  # {datetime: [count, timed, req_times, errors]}
+
+        self._date = None
+        self._prefix = None
+        self._bucket = None
+
+    def _find_bucket(self, date, prefix):
+        self._date = date
+        self._prefix = prefix
+        try:
+            minute = datetime.datetime(date.year, date.month, date.day,
+                                       int(prefix[:2]), int(prefix[3:5]))
+        except ValueError:
+            self._bucket = [0, 0, 0, 0]  # время не разобрать, не учитываем
+            return
+
+        if minute not in self.minutes:
+            self.minutes[minute] = [0, 0, 0, 0]
+        self._bucket = self.minutes[minute]
+
+    def add(self, date, clock, code, req_time):
+        if clock[:5] != self._prefix or date != self._date:
+            self._find_bucket(date, clock[:5])
+
+        bucket = self._bucket
+        bucket[0] += 1
+        if req_time:
+            bucket[1] += 1
+            bucket[2] += int(req_time)
+        if code[0] in '45':
+            bucket[3] += 1
+
+    def merge(self, other):
+        for key, bucket in other.minutes.items():
+            if key in self.minutes:
+                for i, value in enumerate(bucket):
+                    self.minutes[key][i] += value
+            else:
+                self.minutes[key] = bucket
+        self._prefix = None
+
+    def hours(self):
+        hours = {}
+        for minute, bucket in self.minutes.items():
+            hour = minute.replace(minute=0)
+            if hour in hours:
+                for i, value in enumerate(bucket):
+                    hours[hour][i] += value
+            else:
+                hours[hour] = list(bucket)
+        return hours
+
+    @staticmethod
+    def _series(buckets):
+        return {
+            key: (count, errors, req_times / timed if timed else None)
+            for key, (count, timed, req_times, errors)
+            in sorted(buckets.items())
+        }
+
+    def results(self):
+        """{интервал: (запросов, ошибок, среднее время обработки), ...}"""
+        return {
+            'RequestsByMinute': self._series(self.minutes),
+            'RequestsByHour': self._series(self.hours())
+        }
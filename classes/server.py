@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+import json
+import asyncio
+import datetime
+import argparse
+
+from hw5_stripped import LogStat
+
+read_size = 1 << 16
+
+
+def to_json(value):
+    """Результаты с датами в ключах и значениях, пригодные для json.dumps"""
+    if isinstance(value, dict):
+        return {to_json(key): to_json(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_json(item) for item in value]
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return value
+
+
+def split_lines(data):
+    """Полные строки `data` без переводов строк (они понимаются как в
+    текстовом режиме) и байты неполной строки"""
+    lines = data.splitlines(keepends=True)
+    rest = b''
+    if lines and not lines[-1].endswith(b'\n'):
+        rest = lines.pop()  # за '\r' может прийти '\n'
+    return [line.rstrip(b'\r\n') for line in lines], rest
+
+
+def decode_lines(lines):
+    """Строки байт из `split_lines` в строки с '\\n' на конце для LogStat"""
+    return [line.decode('utf-8', 'surrogateescape') + '\n' for line in lines]
+
+
+class UdpProtocol(asyncio.DatagramProtocol):
+    def __init__(self, server):
+        self.server = server
+
+    def datagram_received(self, data, addr):
+        self.server.add_datagram(data)
+
+
+class LogServer:
+    """Принимает строки лога по TCP (поток строк) и UDP (строки в
+    датаграммах), разбирает их в `stat` и отдаёт текущие результаты по HTTP.
+    Между приёмом и разбором очередь из не более `queue_size` пачек строк:
+    когда она полна, TCP-соединения перестают читаться, а датаграммы
+    отбрасываются"""
+
+    def __init__(self, stat=None, queue_size=64, max_line=1 << 16):
+        self.stat = LogStat() if stat is None else stat
+        self.queue = asyncio.Queue(queue_size)
+        self.max_line = max_line
+        self.lines = 0  # разобрано строк
+        self.dropped = 0  # отброшено датаграмм и слишком длинных строк
+        self.errors = 0  # строк, на которых разбор упал
+        self.addresses = {}  # {'tcp': (host, port), ...}
+        self._servers = []
+        self._transport = None
+        self._consumer = None
+
+    async def start(self, host='127.0.0.1', tcp_port=0, udp_port=0,
+                    http_port=0, unix_path=None):
+        """Запускает приём. Порт None отключает соответствующий сервер, 0
+        выбирает свободный порт"""
+        self._consumer = asyncio.ensure_future(self._consume())
+        loop = asyncio.get_running_loop()
+        if tcp_port is not None:
+            server = await asyncio.start_server(self._tcp_client, host,
+                                                tcp_port)
+            self._add_server('tcp', server)
+        if http_port is not None:
+            server = await asyncio.start_server(self._http_client, host,
+                                                http_port)
+            self._add_server('http', server)
+        if unix_path is not None:
+            server = await asyncio.start_unix_server(self._http_client,
+                                                     unix_path)
+            self._servers.append(server)
+            self.addresses['unix'] = unix_path
+        if udp_port is not None:
+            self._transport, _ = await loop.create_datagram_endpoint(
+                lambda: UdpProtocol(self), local_addr=(host, udp_port))
+            self.addresses['udp'] = self._transport.get_extra_info('sockname')
+
+    def _add_server(self, name, server):
+        self._servers.append(server)
+        self.addresses[name] = server.sockets[0].getsockname()[:2]
+
+    async def close(self):
+        if self._transport is not None:
+            self._transport.close()
+        for server in self._servers:
+            server.close()
+            await server.wait_closed()
+        if self._consumer is not None:
+            self._consumer.cancel()
+            try:
+                await self._consumer
+            except asyncio.CancelledError:
+                pass
+
+    async def drain(self):
+        """Ждёт, пока будут разобраны все принятые пачки"""
+        await self.queue.join()
+
+    async def _consume(self):
+        while True:
+            batch = await self.queue.get()
+            try:
+                self._add_batch(batch)
+                self.lines += len(batch)
+            finally:
+                self.queue.task_done()
+            # get() не уступает управление, пока очередь не пуста
+            await asyncio.sleep(0)
+
+    def _add_batch(self, batch):
+        """Разбирает пачку строк. Строка, на которой разбор упал
+        (например, с неверной датой), пропускается и считается в `errors`,
+        разбор продолжается со следующей"""
+        current = 0  # номер строки пачки, которую разбирает stat
+
+        def lines(start):
+            nonlocal current
+            for current in range(start, len(batch)):
+                yield batch[current]
+
+        start = 0
+        while start < len(batch):
+            try:
+                self.stat.add_lines(lines(start))
+                return
+            except Exception:
+                self.errors += 1
+                start = current + 1
+
+    async def _tcp_client(self, reader, writer):
+        rest = b''
+        skip = False  # отбрасываем конец слишком длинной строки
+        try:
+            while True:
+                data = await reader.read(read_size)
+                if not data:
+                    break
+                lines, rest = split_lines(rest + data)
+                if skip and lines:
+                    lines.pop(0)
+                    skip = False
+                kept = [line for line in lines if len(line) <= self.max_line]
+                self.dropped += len(lines) - len(kept)
+                if len(rest) > self.max_line:
+                    self.dropped += 1
+                    rest = b''
+                    skip = True
+                if kept:
+                    await self.queue.put(decode_lines(kept))
+            if rest and not skip:
+                lines = split_lines(rest + b'\n')[0]
+                await self.queue.put(decode_lines(lines))
+        finally:
+            writer.close()
+
+    def add_datagram(self, data):
+        lines, rest = split_lines(data)
+        if rest:
+            lines += split_lines(rest + b'\n')[0]
+        try:
+            self.queue.put_nowait(decode_lines(lines))
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    def snapshot(self):
+        """Текущие результаты `stat` (пустые, пока в нём нет строк для
+        результатов, см. `LogStat._is_empty`) и счётчики сервера"""
+        results = {}
+        if not self.stat._is_empty():
+            results = to_json(self.stat.results())
+        return {
+            'results': results,
+            'lines': self.lines,
+            'dropped': self.dropped,
+            'errors': self.errors,
+            'queued': self.queue.qsize()
+        }
+
+    async def _http_client(self, reader, writer):
+        try:
+            request = (await reader.readline()).split()
+            while (await reader.readline()).strip():
+                pass
+
+            status = '200 OK'
+            if len(request) < 2 or request[0] != b'GET':
+                status, body = '405 Method Not Allowed', {}
+            elif request[1] in (b'/', b'/results'):
+                body = self.snapshot()
+            else:
+                status, body = '404 Not Found', {}
+
+            body = json.dumps(body).encode()
+            writer.write('HTTP/1.0 {0}\r\nContent-Type: application/json\r\n'
+                         'Content-Length: {1}\r\n\r\n'.format(
+                             status, len(body)).encode() + body)
+            await writer.drain()
+        finally:
+            writer.close()
+
+
+async def serve(args):
+    server = LogServer(queue_size=args.queue_size)
+    await server.start(args.host, args.tcp_port, args.udp_port,
+                       args.http_port, args.unix)
+    print(server.addresses, flush=True)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Сервер приёма строк лога для LogStat')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--tcp-port', type=int, default=5140)
+    parser.add_argument('--udp-port', type=int, default=5140)
+    parser.add_argument('--http-port', type=int, default=8080)
+    parser.add_argument('--unix')
+    parser.add_argument('--queue-size', type=int, default=64)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+from collections import OrderedDict
+
+from windows import minute_of
+
+
+def second_of(date, clock):
+    """Номер секунды с 1970 года по дате и времени из лога (минута
+    разбирается как в `minute_of`, неверные секунды считаются нулём, как в
+    columnar) или None"""
+    minute = minute_of(date, clock)
+    if minute is None:
+        return None
+    seconds = clock[6:8]
+    if seconds.isdigit() and int(seconds) < 60:
+        return minute * 60 + int(seconds)
+    return minute * 60
+
+
+class Sessionizer:
+    """Сессии клиентов: запросы клиента, между которыми не больше `timeout`
+    секунд. Открытые сессии лежат в OrderedDict в порядке последнего
+    запроса, поэтому сессии, в которых давно не было запросов, находятся в
+    начале и закрываются, как только время лога уходит от них дальше
+    `timeout`. От закрытых сессий остаются только суммы по клиенту.
+
+    Для `merge` запоминаются начала первых сессий клиентов, начавшихся не
+    позже чем через `timeout` секунд после первой строки: только они могут
+    продолжать сессии, открытые в предыдущей части лога"""
+
+    def __init__(self, timeout=1800):
+        self.timeout = timeout
+        self.open = OrderedDict()  # {ip: [start, last, pages], ...}
+        self.clients = {}  # {ip: [sessions, seconds, pages], ...} закрытых
+        self.starts = {}  # {ip: начало первой сессии клиента, ...}
+        self.first = None  # первая секунда лога
+        self.now = None  # самая поздняя секунда лога
+
+        self._date = None
+        self._clock = None
+        self._second = None
+
+    def add(self, date, clock, ip):
+        if clock != self._clock or date != self._date:
+            self._date = date
+            self._clock = clock
+            self._second = second_of(date, clock)
+        if self._second is not None:
+            self.add_second(self._second, ip)
+
+    def add_second(self, second, ip):
+        if self.first is None:
+            self.first = second
+        if self.now is None or second > self.now:
+            self.now = second
+            self._evict()
+
+        session = self.open.get(ip)
+        if session is not None and second - session[1] > self.timeout:
+            self._close(ip, self.open.pop(ip))
+            session = None
+        if session is None:
+            self.open[ip] = [second, second, 1]
+            if second - self.first <= self.timeout and \
+                    ip not in self.starts:
+                self.starts[ip] = second
+            return
+        if second > session[1]:
+            session[1] = second
+        session[2] += 1
+        self.open.move_to_end(ip)
+
+    def _evict(self):
+        """Закрывает сессии без запросов дольше `timeout` секунд"""
+        horizon = self.now - self.timeout
+        while self.open:
+            ip, session = next(iter(self.open.items()))
+            if session[1] >= horizon:
+                break
+            self._close(ip, self.open.pop(ip))
+
+    def _close(self, ip, session):
+        start, last, pages = session
+        totals = self.clients.get(ip)
+        if totals is None:
+            self.clients[ip] = [1, last - start, pages]
+        else:
+            totals[0] += 1
+            totals[1] += last - start
+            totals[2] += pages
+
+    def merge(self, other):
+        """Добавляет сессии `other`, посчитанные по более поздним строкам:
+        открытая сессия клиента продолжается первой сессией `other`, если
+        она началась не позже чем через `timeout` секунд. Если начала нет в
+        `other.starts`, а клиент в `other` есть, его первая сессия началась
+        позже"""
+        for ip, session in list(self.open.items()):
+            start = other.starts.get(ip)
+            if start is None and ip not in other.open and \
+                    ip not in other.clients:
+                continue
+            del self.open[ip]
+            if start is None or start - session[1] > self.timeout:
+                self._close(ip, session)
+                continue
+            later = other.open.get(ip)
+            if later is not None and later[0] == start:
+                later[0] = session[0]
+                later[2] += session[2]
+            else:
+                totals = other.clients[ip]
+                totals[1] += start - session[0]
+                totals[2] += session[2]
+
+        for ip, totals in other.clients.items():
+            mine = self.clients.get(ip)
+            if mine is None:
+                self.clients[ip] = totals
+            else:
+                self.clients[ip] = [a + b for a, b in zip(mine, totals)]
+        if self.first is None:
+            self.first = other.first
+        for ip, start in other.starts.items():
+            if start - self.first <= self.timeout:
+                self.starts.setdefault(ip, start)
+        self.open = OrderedDict(sorted(
+            list(self.open.items()) + list(other.open.items()),
+            key=lambda item: item[1][1]))
+        if other.now is not None:
+            if self.now is None or other.now > self.now:
+                self.now = other.now
+            self._evict()
+        self._clock = None
+
+    def results(self):
+        """Число сессий, средние длина (в секундах) и число запросов сессии,
+        в том числе по клиентам. Открытые сессии считаются закончившимися на
+        последнем запросе"""
+        clients = {ip: list(totals) for ip, totals in self.clients.items()}
+        for ip, (start, last, pages) in self.open.items():
+            totals = clients.setdefault(ip, [0, 0, 0])
+            totals[0] += 1
+            totals[1] += last - start
+            totals[2] += pages
+
+        sessions = sum(totals[0] for totals in clients.values())
+        return {
+            'Sessions': sessions,
+            'AverageSessionLength': sum(
+                totals[1] for totals in clients.values()) / sessions
+            if sessions else 0.0,
+            'AveragePagesPerSession': sum(
+                totals[2] for totals in clients.values()) / sessions
+            if sessions else 0.0,
+            'SessionsByClient': {
+                ip: {'Sessions': count,
+                     'AverageLength': seconds / count,
+                     'AveragePages': pages / count}
+                for ip, (count, seconds, pages) in clients.items()}
+        }
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+import os
+import pickle
+import tempfile
+
+
+class Spill:
+    """Частичные агрегаты LogStat на диске. Страницы и клиенты раскладываются
+    по `partitions` файлам по хэшу ключа, дни - по хэшу даты, так что все
+    частичные агрегаты одного ключа попадают в один файл и каждую часть
+    можно свести отдельно. Записи части читаются в порядке сброса"""
+
+    def __init__(self, max_keys, partitions=16, directory=None):
+        self.max_keys = max_keys  # ключей в памяти, после которых сброс
+        self.partitions = partitions
+        self.spills = 0  # сколько раз агрегаты сбрасывались на диск
+        self._dir = tempfile.TemporaryDirectory(prefix='logstat-',
+                                                dir=directory)
+        self.paths = [os.path.join(self._dir.name, 'part{0}'.format(i))
+                      for i in range(partitions)]
+
+    def split(self, pages, clients, days):
+        """[(страницы, [(ip, count), ...], {date: {ip: count}}), ...] по
+        частям"""
+        parts = [([], [], {}) for _ in range(self.partitions)]
+        for name, page in pages.items():
+            parts[hash(name) % self.partitions][0].append(page)
+        for name, client in clients.items():
+            parts[hash(name) % self.partitions][1].append(
+                (name, client['count']))
+        for date, day in days.items():
+            parts[hash(date) % self.partitions][2][date] = day
+        return parts
+
+    def write(self, pages, clients, days):
+        for path, part in zip(self.paths, self.split(pages, clients, days)):
+            with open(path, 'ab') as f:
+                pickle.dump(part, f, pickle.HIGHEST_PROTOCOL)
+        self.spills += 1
+
+    def read(self, partition):
+        """Записи части `partition` в порядке сброса"""
+        try:
+            f = open(self.paths[partition], 'rb')
+        except FileNotFoundError:
+            return
+        with f:
+            while True:
+                try:
+                    yield pickle.load(f)
+                except EOFError:
+                    return
+
+    def close(self):
+        self._dir.cleanup()
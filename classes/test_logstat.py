@@ -0,0 +1,1358 @@
+#!/usr/bin/env python3
+
+import os
+import bz2
+import gzip
+import lzma
+import json
+import pickle
+import asyncio
+import random
+import datetime
+import tempfile
+import unittest
+
+from hw5_stripped import LogStat, pattern, parse_line, field_names
+import parallel
+from follow import LogFollower
+from quantiles import QuantileSketch
+from heavy import SpaceSaving, HeavyHitterStat
+from hll import HyperLogLog
+from leaderboard import Leaderboard
+from spill import Spill
+from normalize import Normalizer
+from windows import minute_of
+from sessions import second_of
+import compressed
+import formats
+import columnar
+import server
+import mapreduce
+from cache import ResultCache
+try:
+    import vectorized
+except ImportError:  # нет numpy
+    vectorized = None
+import loggen
+
+
+MONTHS = ['Jan', 'Feb', 'Mar']
+
+
+def make_line(ip, day, page, agent, req_time=None):
+    line = '{0} - - [{1:02}/{2}/2013:06:37:21 +0600] "GET {3} HTTP/1.1" ' \
+           '200 1047 "-" "{4}"'.format(ip, day % 28 + 1, MONTHS[day // 28],
+                                       page, agent)
+    if req_time is not None:
+        line += ' {0}'.format(req_time)
+    return line + '\n'
+
+
+def make_log(count, seed=0):
+    rnd = random.Random(seed)
+    lines = []
+    for i in range(count):
+        lines.append(make_line(
+            '192.168.0.{0}'.format(rnd.randrange(20)),
+            i * 3 // count,
+            '/page{0}?id={1}'.format(rnd.randrange(30), rnd.randrange(3)),
+            'Agent {0}'.format(rnd.randrange(5)),
+            rnd.randrange(1, 500) if rnd.random() < 0.8 else None
+        ))
+        if rnd.random() < 0.05:
+            lines.append('garbage line\n')
+    return lines
+
+
+def stat_of(lines):
+    return stat_of_options(lines)
+
+
+def stat_of_options(lines, **options):
+    stat = LogStat(**options)
+    for line in lines:
+        stat.add_line(line)
+    return stat
+
+
+class LogFileTestCase(unittest.TestCase):
+    def setUp(self):
+        self.lines = make_log(3000)
+        fd, self.path = tempfile.mkstemp()
+        with os.fdopen(fd, 'w') as f:
+            f.writelines(self.lines)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+
+class PageTests(unittest.TestCase):
+    def test_first_line_without_req_time(self):
+        stat = stat_of([make_line('1.1.1.1', 0, '/a', 'A'),
+                        make_line('1.1.1.1', 0, '/a', 'A', 10),
+                        make_line('1.1.1.1', 0, '/a', 'A', 4)])
+        page = stat._pages['/a']
+        self.assertEqual((page.count, page.fast_req_t, page.slow_req_t),
+                         (3, 4, 10))
+        self.assertEqual(page.avg, 14 / 3)
+
+    def test_blank_req_time(self):
+        line = make_line('1.1.1.1', 0, '/a', 'A', '')
+        self.assertTrue(line.endswith('"A" \n'))
+        self.assertIsNone(parse_line(line[:-1]))
+        stat = LogStat()
+        stat.add_from_buffer(line.encode())
+        self.assertEqual(stat._pages, {})
+
+
+class QuantileTests(unittest.TestCase):
+    def test_relative_error(self):
+        rnd = random.Random(4)
+        values = [int(rnd.lognormvariate(8, 2)) for _ in range(20000)]
+        first, second = QuantileSketch(), QuantileSketch()
+        for i, value in enumerate(values):
+            (first if i % 2 else second).add(value)
+        first.merge(second)
+        values.sort()
+        for q in (0.5, 0.95, 0.99):
+            exact = values[int(q * (len(values) - 1))]
+            self.assertAlmostEqual(first.quantile(q), exact,
+                                   delta=exact * QuantileSketch.accuracy)
+
+    def test_bounded(self):
+        sketch = QuantileSketch()
+        for i in range(3000):
+            sketch.add(1.05 ** i)
+        self.assertLessEqual(len(sketch.buckets), QuantileSketch.max_buckets)
+        self.assertEqual(sketch.count, 3000)
+
+    def test_results(self):
+        stat = LogStat(percentiles=True)
+        for req_time in [10] * 98 + [1000, 1000]:
+            stat.add_line(make_line('1.1.1.1', 0, '/tail', 'A', req_time))
+        for req_time in range(100, 200):
+            stat.add_line(make_line('1.1.1.1', 0, '/even', 'A', req_time))
+        results = stat.results()
+        self.assertEqual(results['SlowestAveragePage'], '/even')
+        self.assertEqual(results['SlowestP99Page'], '/tail')
+        self.assertAlmostEqual(results['Percentiles']['/even'][0], 149,
+                               delta=1.5)
+
+
+class HeavyHitterTests(unittest.TestCase):
+    KEYS = ('MostPopularPage', 'MostActiveClient', 'MostPopularBrowser')
+
+    def test_exact_when_fits(self):
+        lines = make_log(3000, seed=5)
+        stat = HeavyHitterStat(capacity=100)
+        for line in lines:
+            stat.add_line(line)
+        results = stat.results()
+        exact = stat_of(lines).results()
+        for key in self.KEYS:
+            self.assertEqual(results[key], exact[key])
+            self.assertEqual(results['Errors'][key], 0)
+
+    def test_skewed_stream(self):
+        rnd = random.Random(6)
+        counter = SpaceSaving(50)
+        exact = {}
+        for _ in range(30000):
+            key = '/page{0}'.format(int(rnd.paretovariate(1.2)))
+            exact[key] = exact.get(key, 0) + 1
+            counter.add(key)
+        self.assertEqual(len(counter.counters), 50)
+        self.assertEqual(counter.top()[0], min(exact,
+                                               key=lambda k: (-exact[k], k)))
+        for key, (count, error) in counter.counters.items():
+            self.assertLessEqual(count - error, exact[key])
+            self.assertLessEqual(exact[key], count)
+            self.assertLessEqual(error, counter.max_error())
+
+
+class HyperLogLogTests(unittest.TestCase):
+    def test_count(self):
+        for distinct in (10, 1000, 50000):
+            counter = HyperLogLog(12)
+            for i in range(distinct):
+                counter.add('10.{0}.{1}'.format(i // 256, i % 256))
+                counter.add('10.0.0')
+            self.assertAlmostEqual(counter.count(), distinct,
+                                   delta=max(1, distinct * 0.05))
+
+    def test_merge(self):
+        first, second, union = HyperLogLog(), HyperLogLog(), HyperLogLog()
+        for i in range(3000):
+            (first if i % 3 else second).add(str(i))
+            union.add(str(i))
+        first.merge(second)
+        self.assertEqual(first.registers, union.registers)
+
+    def test_results(self):
+        lines = make_log(3000, seed=7)
+        stat = LogStat(distinct_clients=True)
+        for line in lines:
+            stat.add_line(line)
+        results = stat.results()
+        for date, clients in stat._days.items():
+            self.assertEqual(results['DistinctClientsByDay'][date],
+                             len(clients))
+        self.assertEqual(len(results['DistinctClientsByPage']),
+                         len(stat._pages))
+
+        merged = LogStat(distinct_clients=True)
+        for part in (lines[:1000], lines[1000:]):
+            stat = LogStat(distinct_clients=True)
+            for line in part:
+                stat.add_line(line)
+            merged.merge(stat)
+        self.assertEqual(merged.results(), results)
+
+
+class RollupTests(unittest.TestCase):
+    def lines(self):
+        for i in range(240):
+            line = make_line('1.1.1.{0}'.format(i % 7), 0, '/r', 'A',
+                             i if i % 3 else None)
+            line = line.replace('06:37:21', '{0:02}:{1:02}:{2:02}'.format(
+                5 + i // 120, i // 4 % 30, i % 60))
+            if i % 10 == 0:
+                line = line.replace('" 200 ', '" 503 ')
+            yield line
+
+    def test_series(self):
+        stat = LogStat(rollups=True)
+        for line in self.lines():
+            stat.add_line(line)
+        results = stat.results()
+        minutes = results['RequestsByMinute']
+        self.assertEqual(len(minutes), 60)
+        self.assertEqual(minutes[datetime.datetime(2013, 1, 1, 5, 0)],
+                         (4, 1, (1 + 2) / 2))
+        self.assertEqual(results['RequestsByHour'], {
+            datetime.datetime(2013, 1, 1, 5, 0):
+                (120, 12, sum(i for i in range(120) if i % 3) / 80),
+            datetime.datetime(2013, 1, 1, 6, 0):
+                (120, 12, sum(i for i in range(120, 240) if i % 3) / 80)
+        })
+
+    def test_merge_and_bytes(self):
+        lines = list(self.lines())
+        merged = LogStat(rollups=True)
+        for part in (lines[:100], lines[100:]):
+            stat = LogStat(rollups=True)
+            stat.add_from_buffer(''.join(part).encode())
+            merged.merge(stat)
+        expected = LogStat(rollups=True)
+        for line in lines:
+            expected.add_line(line)
+        self.assertEqual(merged.results(), expected.results())
+
+
+class LogGenTests(unittest.TestCase):
+    def test_generate(self):
+        lines = list(loggen.generate(5000, pages=50, clients=10, agents=3,
+                                     malformed=0.1, no_req_time=0.2))
+        self.assertEqual(lines, list(loggen.generate(
+            5000, pages=50, clients=10, agents=3, malformed=0.1,
+            no_req_time=0.2)))
+        parsed = [parse_line(line[:-1]) for line in lines]
+        parsed = [fields for fields in parsed if fields]
+        self.assertAlmostEqual(len(parsed), 4500, delta=150)
+        self.assertAlmostEqual(sum(1 for f in parsed if not f[-1]), 900,
+                               delta=150)
+        stat = stat_of(lines)
+        self.assertEqual(len(stat._pages), 50)
+        self.assertEqual(len(stat._clients), 10)
+        self.assertEqual(len(stat._browsers), 3)
+
+
+class MergeTests(unittest.TestCase):
+    def test_merge_equals_sequential(self):
+        lines = make_log(2000, seed=1)
+        for cut in (0, 1, 700, 1999):
+            merged = stat_of(lines[:cut])
+            merged.merge(stat_of(lines[cut:]))
+            self.assertEqual(merged.results(), stat_of(lines).results())
+
+    def test_page_order_kept(self):
+        first = stat_of([make_line('1.1.1.1', 0, '/b', 'A', 5)])
+        first.merge(stat_of([make_line('1.1.1.1', 0, '/a', 'A', 5),
+                             make_line('1.1.1.1', 0, '/b', 'A', 5)]))
+        self.assertEqual(first._pages['/b'].num, 0)
+        self.assertEqual(first._pages['/a'].num, 1)
+        self.assertEqual(first.results()['SlowestAveragePage'], '/b')
+        self.assertEqual(first.results()['SlowestPage'], '/b')
+
+
+class FileInputTests(LogFileTestCase):
+    def test_add_from_file(self):
+        stat = LogStat()
+        stat.add_from_file(self.path)
+        self.assertEqual(stat.results(), stat_of(self.lines).results())
+
+    def test_line_endings(self):
+        lines = make_log(50)
+        data = ''.join(lines).replace('\n', '\r\n')[:-2].encode()
+        stat = LogStat()
+        stat.add_from_buffer(data)
+        lines[-1] = lines[-1][:-1]
+        self.assertEqual(stat.results(), stat_of(lines).results())
+
+
+class ArchiveTests(LogFileTestCase):
+    def check_archive(self, data, processes=2):
+        with open(self.path, 'wb') as f:
+            f.write(data)
+        stat = LogStat()
+        stat.add_from_archive(self.path, processes)
+        self.assertEqual(stat.results(), stat_of(self.lines).results())
+
+    def test_bz2_blocks(self):
+        data = ''.join(self.lines).encode() * 3
+        self.lines *= 3
+        archive = bz2.compress(data, 1)
+        self.assertGreater(len(compressed.bz2_regions(archive)), 2)
+        self.check_archive(archive)
+
+    def test_bz2_multistream(self):
+        data = ''.join(self.lines).encode()
+        self.check_archive(bz2.compress(data[:1000], 1) +
+                           bz2.compress(data[1000:], 1))
+
+    def test_bz2_false_magic(self):
+        archive = bz2.compress(''.join(self.lines).encode(), 1)
+        regions = compressed.bz2_regions(archive)
+        start, end = regions[0]
+        split = (start + end) // 2
+        with open(self.path, 'wb') as f:
+            f.write(archive)
+        with self.assertRaises((OSError, ValueError)):
+            compressed.decompress_region(self.path, start, split)
+        blocks = compressed.bz2_regions
+        compressed.bz2_regions = lambda data: \
+            [(start, split), (split, end)] + regions[1:]
+        try:
+            self.check_archive(archive)
+        finally:
+            compressed.bz2_regions = blocks
+
+    def test_gzip_and_xz(self):
+        data = ''.join(self.lines).encode()
+        self.check_archive(gzip.compress(data))
+        self.check_archive(lzma.compress(data))
+        self.check_archive(data[:-1])
+
+
+class ParallelTests(LogFileTestCase):
+    def test_split_file(self):
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        chunks = parallel.split_file(self.path, 7)
+        self.assertEqual(chunks[0][0], 0)
+        self.assertEqual(chunks[-1][1], len(data))
+        for start, end in chunks:
+            self.assertIn(data[start - 1:start], (b'', b'\n'))
+
+    def test_parallel_stat(self):
+        self.assertEqual(parallel.parallel_stat(self.path, 3).results(),
+                         stat_of(self.lines).results())
+
+    def test_parallel_percentiles(self):
+        stat = LogStat(percentiles=True)
+        stat.add_from_file(self.path)
+        self.assertEqual(
+            parallel.parallel_stat(self.path, 3, percentiles=True).results(),
+            stat.results())
+
+
+class InstrumentTests(LogFileTestCase):
+    def counts(self, stat):
+        metrics = stat.metrics()
+        return tuple(metrics[key] for key in
+                     ('lines', 'matched', 'rejected', 'no_req_time'))
+
+    def test_counters(self):
+        expected = stat_of(self.lines)
+        rejected = sum(1 for line in self.lines if not parse_line(line[:-1]))
+        no_req_time = sum(1 for line in self.lines
+                          if parse_line(line[:-1]) and
+                          not parse_line(line[:-1])[-1])
+        counts = (len(self.lines), len(self.lines) - rejected, rejected,
+                  no_req_time)
+
+        stat = LogStat(instrument=7)
+        for line in self.lines:
+            stat.add_line(line)
+        self.assertEqual(self.counts(stat), counts)
+        self.assertEqual(stat.metrics()['sampled'], len(self.lines) // 7)
+        results = stat.results()
+        self.assertEqual(results.pop('Metrics')['lines'], len(self.lines))
+        self.assertEqual(results, expected.results())
+
+        stat = LogStat(instrument=True)
+        stat.add_from_file(self.path)
+        self.assertEqual(self.counts(stat), counts)
+        stat = LogStat(instrument=True)
+        stat.add_from_archive(self.path)
+        self.assertEqual(self.counts(stat), counts)
+
+    def test_disabled_and_pickled(self):
+        self.assertIsNone(stat_of(self.lines).metrics())
+        self.assertNotIn('add_line', vars(LogStat()))
+
+        stat = LogStat(instrument=True)
+        stat.add_line(self.lines[0])
+        stat = pickle.loads(pickle.dumps(stat))
+        stat.add_line(self.lines[1])
+        self.assertEqual(stat.metrics()['lines'], 2)
+
+
+class ColumnarTests(LogFileTestCase):
+    def test_load_equals_parse(self):
+        cache = self.path + '.col'
+        self.addCleanup(os.remove, cache)
+        self.lines.append(make_line('10.0.0.1', 0, '/x', 'A', ''))
+        with open(self.path, 'a') as f:
+            f.write(self.lines[-1])
+        options = {'percentiles': True, 'distinct_clients': True,
+                   'rollups': True}
+        expected = LogStat(**options)
+        expected.add_from_file(self.path)
+
+        columnar.convert(self.path, cache)
+        self.assertEqual(columnar.load(cache).results(),
+                         stat_of(self.lines).results())
+        self.assertEqual(columnar.load(cache, **options).results(),
+                         expected.results())
+        with columnar.Columns(cache) as cols:
+            self.assertEqual(cols.rows, len(cols.time))
+            self.assertEqual(cols.rows, sum(
+                1 for line in self.lines if parse_line(line[:-1])))
+
+    def test_compressed_and_empty(self):
+        cache = self.path + '.col'
+        self.addCleanup(os.remove, cache)
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        with gzip.open(self.path, 'wb') as f:
+            f.write(data)
+        columnar.convert(self.path, cache)
+        self.assertEqual(columnar.load(cache).results(),
+                         stat_of(self.lines).results())
+
+        open(self.path, 'w').close()
+        columnar.convert(self.path, cache)
+        stat = columnar.load(cache)
+        self.assertEqual((stat._pages, stat._clients, stat.timed), ({}, {}, 0))
+
+
+@unittest.skipIf(vectorized is None, 'numpy is not installed')
+class BatchStatTests(LogFileTestCase):
+    def test_same_results(self):
+        for options in ({}, {'percentiles': True, 'distinct_clients': True,
+                             'rollups': True}):
+            expected = LogStat(**options)
+            expected.add_from_file(self.path)
+            stat = vectorized.BatchStat(500, **options)
+            stat.add_from_file(self.path)
+            self.assertEqual(stat.results(), expected.results())
+
+            expected = LogStat(**options)
+            stat = vectorized.BatchStat(777, **options)
+            for line in self.lines:
+                expected.add_line(line)
+                stat.add_line(line)
+            self.assertEqual(stat.results(), expected.results())
+
+    def test_many_blocks(self):
+        # лидеры обновляются по ключам блоков, а не пересчитываются
+        lines = list(loggen.generate(3000, pages=800, clients=300,
+                                     malformed=0, seed=6, step=5))
+        options = {'top': 3, 'sessions': 600, 'windows': (5,)}
+        expected = LogStat(**options)
+        stat = vectorized.BatchStat(97, **options)
+        for i in range(0, len(lines), 700):
+            expected.add_lines(lines[i:i + 700])
+            stat.add_lines(lines[i:i + 700])
+            self.assertEqual(stat.results(), expected.results())
+        stat = vectorized.BatchStat(97, percentiles=True)
+        stat.add_from_buffer(''.join(lines).encode())
+        self.assertEqual(stat.results(), stat_of_options(
+            lines, percentiles=True).results())
+
+    def test_ties_across_blocks(self):
+        lines = [make_line('1.1.1.2', 0, '/b', 'B', 5),
+                 make_line('1.1.1.1', 0, '/a', 'A', 5),
+                 make_line('1.1.1.1', 1, '/a', 'B'),
+                 make_line('1.1.1.2', 1, '/b', 'A', 5)]
+        stat = vectorized.BatchStat(1)
+        stat.add_line(lines[0])
+        stat.add_from_buffer(''.join(lines[1:3]).encode())
+        stat.add_line(lines[3])
+        self.assertEqual(stat.results(), stat_of(lines).results())
+
+
+class ServerTests(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.unix = os.path.join(self.dir.name, 'http.sock')
+        self.server = server.LogServer(queue_size=2)
+        await self.server.start(unix_path=self.unix)
+
+    async def asyncTearDown(self):
+        await self.server.close()
+        self.dir.cleanup()
+
+    async def wait_lines(self, count):
+        for _ in range(500):
+            if self.server.lines >= count:
+                break
+            await asyncio.sleep(0.01)
+        await self.server.drain()
+
+    async def get(self, path, unix=False):
+        if unix:
+            reader, writer = await asyncio.open_unix_connection(self.unix)
+        else:
+            reader, writer = await asyncio.open_connection(
+                *self.server.addresses['http'])
+        writer.write('GET {0} HTTP/1.0\r\n\r\n'.format(path).encode())
+        response = await reader.read()
+        writer.close()
+        head, body = response.split(b'\r\n\r\n', 1)
+        return head.split()[1], json.loads(body)
+
+    async def test_tcp_clients(self):
+        lines = make_log(2000)
+        self.assertEqual((await self.get('/results'))[1]['results'], {})
+
+        async def send(part):
+            _, writer = await asyncio.open_connection(
+                *self.server.addresses['tcp'])
+            data = ''.join(part).encode()
+            for i in range(0, len(data), 1000):
+                writer.write(data[i:i + 1000].replace(b'\n', b'\r\n'))
+                await writer.drain()
+            writer.close()
+            await writer.wait_closed()
+
+        # строки разных соединений перемешиваются, поэтому у каждого свой день
+        parts = [[line for line in lines if '/{0}/'.format(month) in line]
+                 for month in MONTHS]
+        await asyncio.gather(*(send(part) for part in parts))
+        lines = sum(parts, [])
+        await self.wait_lines(len(lines))
+
+        expected = stat_of(lines).results()
+        status, body = await self.get('/results', unix=True)
+        self.assertEqual(status, b'200')
+        self.assertEqual(body['lines'], len(lines))
+        self.assertEqual(body['results']['MostActiveClientByDay'], {
+            date.isoformat(): client for date, client
+            in expected['MostActiveClientByDay'].items()})
+        self.assertEqual(body['results']['MostPopularPage'],
+                         expected['MostPopularPage'])
+        self.assertEqual((await self.get('/nope'))[0], b'404')
+
+    async def test_udp(self):
+        transport, _ = await asyncio.get_running_loop() \
+            .create_datagram_endpoint(asyncio.DatagramProtocol,
+                                      remote_addr=self.server.addresses['udp'])
+        lines = make_log(20)
+        transport.sendto(''.join(lines[:10]).encode())
+        transport.sendto(''.join(lines[10:]).rstrip('\n').encode())
+        transport.close()
+        await self.wait_lines(len(lines))
+        self.assertEqual(self.server.stat.results(), stat_of(lines).results())
+
+    async def test_bad_line(self):
+        # строка с неверным месяцем не останавливает разбор
+        lines = make_log(300)
+        bad = lines[0].replace('/Jan/', '/Foo/')
+        _, writer = await asyncio.open_connection(
+            *self.server.addresses['tcp'])
+        for line in [bad] + lines[:100] + [bad]:
+            writer.write(line.encode())
+        await writer.drain()
+        for i in range(100, len(lines), 10):
+            writer.write(''.join(lines[i:i + 10]).encode())
+            await writer.drain()
+        writer.close()
+        await writer.wait_closed()
+        await self.wait_lines(len(lines) + 2)
+
+        body = (await self.get('/results'))[1]
+        self.assertEqual(body['errors'], 2)
+        self.assertEqual(body['lines'], len(lines) + 2)
+        self.assertEqual(self.server.stat.results(), stat_of(lines).results())
+
+    async def test_long_line(self):
+        # слишком длинная полная строка внутри одного чтения тоже отброшена
+        self.server.max_line = 300
+        lines = make_log(10)
+        long = lines[0].replace(' HTTP', '/' + 'x' * 400 + ' HTTP')
+        _, writer = await asyncio.open_connection(
+            *self.server.addresses['tcp'])
+        writer.write(''.join(lines[:5] + [long] + lines[5:]).encode())
+        writer.close()
+        await writer.wait_closed()
+        await self.wait_lines(len(lines))
+        self.assertEqual(self.server.lines, len(lines))
+        self.assertEqual(self.server.dropped, 1)
+        self.assertEqual(self.server.stat.results(), stat_of(lines).results())
+
+    async def test_snapshot_without_pages(self):
+        combined = '10.0.0.1 - bob [10/Jan/2013:06:37:21 +0600] "GET /a ' \
+                   'HTTP/1.1" 200 12 "-" "Agent"\n'
+        for stat, lines in ((LogStat(only={'MostActiveClient'}),
+                             make_log(20)),
+                            (LogStat(log_format=formats.combined_format),
+                             [combined] * 3)):
+            log_server = server.LogServer(stat)
+            self.assertEqual(log_server.snapshot()['results'], {})
+            for line in lines:
+                stat.add_line(line)
+            self.assertNotEqual(log_server.snapshot()['results'], {})
+            self.assertEqual(log_server.snapshot()['results'],
+                             server.to_json(stat.results()))
+
+    async def test_backpressure(self):
+        self.server._consumer.cancel()
+        for _ in range(5):
+            self.server.add_datagram(b'line\n')
+        self.assertEqual(self.server.dropped, 3)
+        self.assertEqual(self.server.queue.qsize(), 2)
+
+
+class LeaderboardTests(unittest.TestCase):
+    def test_top_n(self):
+        rnd = random.Random(5)
+        board = Leaderboard(4)
+        counts = {}
+        for i in range(3000):
+            key = 'k{0}'.format(min(rnd.randrange(40), rnd.randrange(40)))
+            counts[key] = counts.get(key, 0) + 1
+            board.update(key, counts[key])
+            if i % 97 == 0:
+                expected = sorted(counts.items(),
+                                  key=lambda item: (-item[1], item[0]))[:4]
+                self.assertEqual(board.leaders(), expected)
+                self.assertEqual(board.leader(), expected[0][0])
+
+    def test_polled_results(self):
+        # много одинаковых счётчиков, чтобы проверить правила выбора
+        rnd = random.Random(3)
+        stat = LogStat(top=3)
+        for i in range(1500):
+            stat.add_line(make_line(
+                '10.0.0.{0}'.format(rnd.randrange(6)), rnd.randrange(3),
+                '/p{0}'.format(rnd.randrange(8)), 'A{0}'.format(
+                    rnd.randrange(3)), rnd.choice([None, 1, 2, 4])))
+            if i % 11 or stat.fastest is None:
+                continue
+            results = stat.results()
+            pages = list(stat._pages.values())
+            self.assertEqual(results['MostPopularPage'], min(
+                pages, key=lambda page: (-page.count, page.name)).name)
+            self.assertEqual(results['MostActiveClient'], min(
+                stat._clients,
+                key=lambda name: (-stat._clients[name]['count'], name)))
+            self.assertEqual(results['MostPopularBrowser'], min(
+                stat._browsers, key=lambda b: (-stat._browsers[b], b)))
+            self.assertEqual(results['MostActiveClientByDay'], {
+                date: max(day, key=day.get)
+                for date, day in stat._days.items()})
+            timed = [page for page in pages if page.last != -1]
+            slowest = max(page.avg for page in timed)
+            self.assertEqual(results['SlowestAveragePage'], min(
+                (page for page in timed if page.avg == slowest),
+                key=lambda page: page.num).name)
+            self.assertEqual(results['TopPages'], sorted(
+                ((page.name, page.count) for page in pages),
+                key=lambda item: (-item[1], item[0]))[:3])
+
+
+    def test_day_ties(self):
+        # ничьи между сотнями клиентов дня, в том числе после склейки
+        ips = ['10.0.{0}.{1}'.format(i // 200, i % 200) for i in range(600)]
+        lines = [make_line(ip, 0, '/a', 'A', 5) for ip in ips[:300]] + \
+            [make_line(ips[300], 0, '/a', 'A', 5)] * 2 + \
+            [make_line(ip, 0, '/a', 'A', 5) for ip in ips[301:]
+             for _ in range(2)] + \
+            [make_line(ip, 0, '/a', 'A', 5) for ip in ips[400:500]]
+        stat = LogStat()
+        for i, line in enumerate(lines):
+            if i == 450:
+                stat.merge(stat_of(lines[450:550]))
+            if i < 450 or i >= 550:
+                stat.add_line(line)
+            if i % 50 == 0:
+                self.assertEqual(stat.results()['MostActiveClientByDay'], {
+                    date: max(day, key=day.get)
+                    for date, day in stat._days.items()})
+        self.assertEqual(stat.results()['MostActiveClientByDay'],
+                         {datetime.date(2013, 1, 1): ips[400]})
+
+
+class WindowTests(unittest.TestCase):
+    def setUp(self):
+        self.lines = list(loggen.generate(3000, pages=40, clients=15,
+                                          malformed=0, seed=2, step=7))
+
+    def expected(self, fields, minutes):
+        end = minute_of(*fields[-1][:2])
+        pages = {}
+        clients = {}
+        for date, clock, name, ip, req_time in fields:
+            if minute_of(date, clock) <= end - minutes:
+                continue
+            page = pages.setdefault(name, [0, 0, 0])
+            page[0] += 1
+            page[1] += 1 if req_time else 0
+            page[2] += int(req_time) if req_time else 0
+            clients[ip] = clients.get(ip, 0) + 1
+        return pages, clients
+
+    def test_sliding(self):
+        stat = LogStat(windows=(5, 60))
+        fields = []
+        for i, line in enumerate(self.lines):
+            stat.add_line(line)
+            ip, time, clock, name, _, _, req_time = parse_line(line[:-1])
+            fields.append((LogStat._get_date(time), clock, name, ip,
+                           req_time))
+            if i % 101 == 0:
+                for minutes, window in stat.windows.windows.items():
+                    self.assertEqual((window.pages, window.clients),
+                                     self.expected(fields, minutes))
+                    self.assertLessEqual(
+                        sum(bucket is not None for bucket in window.ring),
+                        minutes)
+
+        results = stat.results()['Windows'][5]
+        pages, clients = self.expected(fields, 5)
+        self.assertEqual(results['MostActiveClient'], min(
+            clients, key=lambda ip: (-clients[ip], ip)))
+
+        # строка старше окна не учитывается
+        window = stat.windows.windows[5]
+        before = dict(window.clients)
+        stat.add_line(self.lines[0])
+        self.assertEqual(window.clients, before)
+
+    def test_merge_and_backends(self):
+        expected = LogStat(windows=(5, 60))
+        for line in self.lines:
+            expected.add_line(line)
+        expected = expected.results()['Windows']
+
+        merged = LogStat(windows=(5, 60))
+        for line in self.lines[:2990]:
+            merged.add_line(line)
+        tail = LogStat(windows=(5, 60))
+        for line in self.lines[2990:]:
+            tail.add_line(line)
+        merged.merge(tail)
+        self.assertEqual(merged.results()['Windows'], expected)
+
+        fd, path = tempfile.mkstemp()
+        self.addCleanup(os.remove, path)
+        with os.fdopen(fd, 'w') as f:
+            f.writelines(self.lines)
+        columnar.convert(path, path + '.col')
+        self.addCleanup(os.remove, path + '.col')
+        self.assertEqual(columnar.load(path + '.col', windows=(5, 60))
+                         .results()['Windows'], expected)
+        if vectorized is not None:
+            stat = vectorized.BatchStat(700, windows=(5, 60))
+            stat.add_from_file(path)
+            self.assertEqual(stat.results()['Windows'], expected)
+
+
+class FormatTests(LogFileTestCase):
+    def test_default_format(self):
+        parse = formats.compile_format(formats.default_format)
+        self.assertIs(parse, formats.compile_format(formats.default_format))
+        short = formats.compile_format(
+            formats.default_format[:-len(' $req_time')])
+        agents = ['Mozilla/5.0 (X11; "Linux") "x" y', '" "', '', 'a" "b']
+        lines = [line[:-1] for line in self.lines]
+        lines += [make_line('10.0.0.1', 0, '/x', agent, 7)[:-1]
+                  for agent in agents]
+        lines += [make_line('10.0.0.1', 0, '/x', 'A', '')[:-1],
+                  make_line('10.0.0.1', 0, '/x', 'A', '-')[:-1]]
+        for line in lines:
+            log = pattern.match(line)
+            expected = log and log.group(*field_names)
+            if expected and not expected[-1]:
+                self.assertEqual(short(line), expected, line)
+                self.assertEqual(parse(line), expected, line)
+            elif expected:
+                self.assertEqual(parse(line),
+                                 expected[:-1] + (expected[-1][1:],), line)
+            else:
+                self.assertIsNone(parse(line), line)
+
+        stat = LogStat(log_format=formats.default_format)
+        stat.add_from_file(self.path)
+        self.assertEqual(stat.results(), stat_of(self.lines).results())
+
+    def test_nginx_and_apache(self):
+        line = '10.0.0.1 - bob [10/Jan/2013:06:37:21 +0600] "BREW /a?b=1 ' \
+               'HTTP/1.1" 404 12 "http://x/" "Agent "1""'
+        self.assertIsNone(formats.compile_format(
+            formats.combined_format)(line))
+        line = line.replace('BREW', 'POST')
+        fields = ('10.0.0.1', '10/Jan/2013', '06:37:21', '/a?b=1', '404',
+                  'Agent "1"', '')
+        self.assertEqual(formats.compile_format(
+            formats.combined_format)(line), fields)
+        self.assertEqual(formats.compile_format(
+            formats.apache_combined_format)(line), fields)
+
+        stat = LogStat(log_format='$remote_addr [$time_local] "$request" '
+                                  '$status $request_time')
+        stat.add_line('10.0.0.1 [10/Jan/2013:06:37:21 +0600] "GET /a '
+                      'HTTP/1.1" 200 0.250\n')
+        stat.add_line('10.0.0.2 [10/Jan/2013:06:37:22 +0600] "GET /a '
+                      'HTTP/1.1" 200 -\n')
+        stat.add_line('10.0.0.2 [10/Jan/2013:06:37:22 +0600] "GET /a '
+                      'HTTP/1.1" 2000 1\n')
+        page = stat._pages['/a']
+        self.assertEqual((page.count, page.slow_req_t), (2, 250000))
+
+        restored = pickle.loads(pickle.dumps(stat))
+        restored.add_line('10.0.0.3 [10/Jan/2013:06:37:23 +0600] "GET /b '
+                          'HTTP/1.1" 200 %D\n')
+        self.assertNotIn('/b', restored._pages)
+        self.assertEqual(formats.compile_format('%h [%t] "%r" %s %D')(
+            '1.2.3.4 [[10/Jan/2013:06:37:21 +0600]] "GET / HTTP/1.0" 200 7'),
+            ('1.2.3.4', '10/Jan/2013', '06:37:21', '/', '200', '', '7'))
+
+    def test_untimed_formats(self):
+        line = '10.0.0.1 - bob [10/Jan/2013:06:37:21 +0600] "GET /a ' \
+               'HTTP/1.1" 200 12 "-" "Agent"\n'
+        for spec in (formats.combined_format,
+                     formats.apache_combined_format):
+            stat = LogStat(log_format=spec, percentiles=True)
+            stat.add_line(line)
+            results = stat.results()
+            self.assertEqual(
+                [results[key] for key in ('FastestPage', 'SlowestPage',
+                                          'SlowestAveragePage',
+                                          'SlowestP99Page')],
+                [None] * 4)
+            self.assertEqual((results['MostPopularPage'],
+                              results['MostActiveClient']),
+                             ('/a', '10.0.0.1'))
+
+    def test_invalid_formats(self):
+        for spec in ('$remote_addr "$request" $status',
+                     '$remote_addr$time_local "$request" $status',
+                     '%h %t "%r" %>s %Z'):
+            with self.assertRaises(ValueError):
+                formats.compile_format(spec)
+
+
+class SpillTests(unittest.TestCase):
+    def setUp(self):
+        self.lines = list(loggen.generate(8000, pages=2000, clients=500,
+                                          malformed=0, seed=4, step=30))
+
+    def test_same_results(self):
+        for options in ({}, {'percentiles': True},
+                        {'distinct_clients': True, 'top': 5}):
+            expected = LogStat(**options)
+            stat = LogStat(spill=1500, **options)
+            for line in self.lines:
+                expected.add_line(line)
+                stat.add_line(line)
+            self.assertGreater(stat.spill.spills, 2)
+            self.assertLess(len(stat._pages), 1500 + stat.spill_check_every)
+            self.assertEqual(stat.results(), expected.results())
+
+            # после results() сброс и разбор продолжаются
+            for line in self.lines[:3000]:
+                expected.add_line(line)
+                stat.add_line(line)
+            self.assertEqual(stat.results(), expected.results())
+
+    def test_merge(self):
+        stat = LogStat(spill=1500)
+        for line in self.lines[:6000]:
+            stat.add_line(line)
+        tail = LogStat()
+        for line in self.lines[6000:]:
+            tail.add_line(line)
+        stat.merge(tail)
+        expected = LogStat()
+        for line in self.lines:
+            expected.add_line(line)
+        self.assertEqual(stat.results(), expected.results())
+        with self.assertRaises(ValueError):
+            LogStat().merge(stat)
+
+    def test_partitions(self):
+        spill = Spill(10, partitions=4)
+        self.addCleanup(spill.close)
+        stat = stat_of(make_log(300))
+        spill.write(stat._pages, stat._clients, stat._days)
+        spill.write(stat._pages, stat._clients, stat._days)
+        names = set()
+        for i in range(4):
+            records = list(spill.read(i))
+            self.assertEqual(len(records), 2)
+            pages = {page.name for page in records[0][0]}
+            self.assertFalse(pages & names)
+            names |= pages
+        self.assertEqual(names, set(stat._pages))
+
+
+class NormalizerTests(LogFileTestCase):
+    def test_rules(self):
+        normalizer = Normalizer(keep=('id',), prefixes={
+            '/api/{int}/search': ('q',), '/raw': None})
+        for name, template in [
+                ('/pause/ajaxPause?pauseConfigId=&admin=0',
+                 '/pause/ajaxPause'),
+                ('/a/123/b?x=1&id=5', '/a/{int}/b?id=5'),
+                ('/api/7/search?id=1&q=x', '/api/{int}/search?q=x'),
+                ('/raw/5?z=1', '/raw/{int}?z=1'),
+                ('/u/123e4567-e89b-12d3-a456-426614174000',
+                 '/u/{uuid}'),
+                ('/', '/')]:
+            self.assertEqual(normalizer.normalize(name), template)
+        self.assertEqual(Normalizer(keep=None, collapse=False).normalize(
+            '/a/1?b=2'), '/a/1?b=2')
+
+        small = Normalizer(memo_size=4)
+        for i in range(10):
+            small.normalize('/page/{0}'.format(i))
+        self.assertLessEqual(len(small._memo), 4)
+
+    def test_backends(self):
+        normalizer = Normalizer(keep=())
+        expected = stat_of(
+            line.replace('?id=0', '').replace('?id=1', '')
+            .replace('?id=2', '') for line in self.lines).results()
+        stat = stat_of_options(self.lines, normalize=normalizer)
+        self.assertEqual(len(stat._pages), 30)
+        self.assertEqual(stat.results(), expected)
+        restored = pickle.loads(pickle.dumps(stat))
+        restored.add_line(make_line('1.1.1.1', 0, '/new?id=9', 'A', 1))
+        self.assertIn('/new', restored._pages)
+
+        stat = LogStat(normalize=normalizer)
+        stat.add_from_file(self.path)
+        self.assertEqual(stat.results(), expected)
+        columnar.convert(self.path, self.path + '.col')
+        self.addCleanup(os.remove, self.path + '.col')
+        self.assertEqual(columnar.load(self.path + '.col',
+                                       normalize=normalizer).results(),
+                         expected)
+        if vectorized is not None:
+            stat = vectorized.BatchStat(700, normalize=normalizer)
+            stat.add_from_file(self.path)
+            self.assertEqual(stat.results(), expected)
+
+
+class AddLinesTests(unittest.TestCase):
+    def test_same_as_add_line(self):
+        lines = make_log(3000, seed=8) + [
+            make_line('1.1.1.1', 0, '/last', 'A', 35)[:-1], '', '\n']
+        for options in ({}, {'rollups': True, 'distinct_clients': True,
+                             'windows': (5,)},
+                        {'log_format': formats.default_format},
+                        {'normalize': True}, {'instrument': 7},
+                        {'spill': 50}):
+            expected = stat_of_options(lines, **options)
+            stat = LogStat(**options)
+            stat.add_lines(lines[:1000])
+            stat.add_lines(iter(lines[1000:]))
+            results = stat.results()
+            expected = expected.results()
+            if 'Metrics' in results:
+                for metrics in (results['Metrics'], expected['Metrics']):
+                    for key in ('per_line', 'estimated', 'elapsed'):
+                        del metrics[key]
+            self.assertEqual(results, expected, options)
+
+    def mutate(self, rnd, line):
+        line = list(line)
+        for _ in range(rnd.randrange(4)):
+            i = rnd.randrange(len(line) + 1)
+            action = rnd.randrange(3)
+            if action == 0 and i < len(line):
+                del line[i]
+            elif action == 1 and i < len(line):
+                line[i] = rnd.choice(' "[]:*/-_0123456789aZ\t\xe9')
+            else:
+                line.insert(i, rnd.choice(' "[]:*/-_0123456789aZ\t\xe9'))
+        return ''.join(line)
+
+    def test_mutated_lines(self):
+        # быстрый путь с pattern принимает те же строки, что и parse_line
+        rnd = random.Random(3)
+        lines = []
+        for line in make_log(5000, seed=10) * 4:
+            line = self.mutate(rnd, line[:-1]) + '\n'
+            try:
+                LogStat().add_line(line)
+            except (ValueError, IndexError):  # неверная дата или время
+                continue
+            lines.append(line)
+        stat = LogStat()
+        stat.add_lines(lines)
+        self.assertEqual(
+            sum(client['count'] for client in stat._clients.values()),
+            sum(1 for line in lines if parse_line(line[:-1])))
+        self.assertEqual(stat.results(), stat_of(lines).results())
+
+    def test_buffer(self):
+        lines = make_log(500, seed=9)
+        stat = LogStat()
+        stat.add_lines(''.join(lines).encode())
+        self.assertEqual(stat.results(), stat_of(lines).results())
+
+
+class SessionTests(unittest.TestCase):
+    def setUp(self):
+        self.lines = list(loggen.generate(6000, clients=200, malformed=0,
+                                          seed=6, step=20))
+
+    def test_same_as_offline(self):
+        stat = LogStat(sessions=600)
+        stat.add_lines(self.lines)
+        self.assertLess(len(stat.sessions.open), 100)
+        self.assertLess(len(stat.sessions.starts), 60)
+
+        requests = {}  # {ip: [секунда, ...], ...}
+        for line in self.lines:
+            ip, time, clock, _, _, _, _ = parse_line(line[:-1])
+            requests.setdefault(ip, []).append(
+                second_of(LogStat._get_date(time), clock))
+        expected = {}
+        for ip, seconds in requests.items():
+            sessions = [[seconds[0]]]
+            for second in seconds[1:]:
+                if second - sessions[-1][-1] > 600:
+                    sessions.append([])
+                sessions[-1].append(second)
+            expected[ip] = {
+                'Sessions': len(sessions),
+                'AverageLength': sum(session[-1] - session[0]
+                                     for session in sessions) / len(sessions),
+                'AveragePages': sum(map(len, sessions)) / len(sessions)}
+
+        results = stat.results()
+        self.assertEqual(results['SessionsByClient'], expected)
+        self.assertEqual(results['Sessions'], sum(
+            client['Sessions'] for client in expected.values()))
+
+    def test_merge_and_backends(self):
+        expected = LogStat(sessions=600)
+        expected.add_lines(self.lines)
+        expected = expected.results()
+        for cut in (0, 1, 30, 2500, 5999):
+            merged = LogStat(sessions=600)
+            merged.add_lines(self.lines[:cut])
+            tail = LogStat(sessions=600)
+            tail.add_lines(self.lines[cut:])
+            merged.merge(tail)
+            self.assertEqual(merged.results(), expected)
+        parts = []
+        for start, end in ((0, 1000), (1000, 1010), (1010, 6000)):
+            parts.append(LogStat(sessions=600))
+            parts[-1].add_lines(self.lines[start:end])
+        parts[1].merge(parts[2])
+        parts[0].merge(parts[1])
+        self.assertEqual(parts[0].results(), expected)
+
+        fd, path = tempfile.mkstemp()
+        self.addCleanup(os.remove, path)
+        with os.fdopen(fd, 'w') as f:
+            f.writelines(self.lines)
+        columnar.convert(path, path + '.col')
+        self.addCleanup(os.remove, path + '.col')
+        self.assertEqual(columnar.load(path + '.col', sessions=600).results(),
+                         expected)
+        if vectorized is not None:
+            stat = vectorized.BatchStat(700, sessions=600)
+            stat.add_from_file(path)
+            self.assertEqual(stat.results(), expected)
+
+
+class StateTests(unittest.TestCase):
+    def setUp(self):
+        self.lines = list(loggen.generate(4000, pages=300, clients=50,
+                                          malformed=0, seed=10, step=15))
+
+    def test_round_trip(self):
+        for options in ({}, {'percentiles': True, 'distinct_clients': True,
+                             'rollups': True, 'windows': (5,),
+                             'sessions': 600, 'top': 3},
+                        {'normalize': True, 'instrument': 10}):
+            stat = LogStat(**options)
+            stat.add_lines(self.lines[:3000])
+            data = stat.dump()
+            self.assertLess(len(data), len(pickle.dumps(stat)))
+            loaded = LogStat.load(data)
+            for part in (stat, loaded):
+                part.add_lines(self.lines[3000:])
+            results, expected = loaded.results(), stat.results()
+            if 'Metrics' in results:
+                for metrics in (results['Metrics'], expected['Metrics']):
+                    for key in ('elapsed', 'per_line', 'estimated'):
+                        del metrics[key]
+            self.assertEqual(results, expected, options)
+
+        with self.assertRaises(ValueError):
+            LogStat.load(b'garbage')
+
+    def test_merge_tree(self):
+        expected = LogStat(top=5)
+        expected.add_lines(self.lines)
+        expected = expected.results()
+        for parts in (1, 2, 5, 8):
+            stats = []
+            for i in range(parts):
+                stat = LogStat(top=5)
+                stat.add_lines(self.lines[len(self.lines) * i // parts:
+                                          len(self.lines) * (i + 1) // parts])
+                stats.append(LogStat.load(stat.dump()))
+            self.assertEqual(mapreduce.merge_tree(stats).results(), expected)
+
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        if vectorized is not None:
+            stat = vectorized.BatchStat(700, top=5)
+            stat.add_lines(self.lines)
+            mapreduce.write_stat(stat, path)
+            self.assertEqual(mapreduce.read_stat(path).results(), expected)
+
+
+class OnlyTests(unittest.TestCase):
+    def setUp(self):
+        self.lines = list(loggen.generate(4000, pages=300, clients=50,
+                                          malformed=0, seed=11, step=15))
+        stat = LogStat(top=3)
+        stat.add_lines(self.lines)
+        self.expected = stat.results()
+
+    def check(self, stat, only):
+        self.assertEqual(stat.results(), {
+            key: value for key, value in self.expected.items()
+            if key in only})
+
+    def test_selected_results(self):
+        for only in ({'SlowestPage'}, {'MostActiveClientByDay'},
+                     {'MostActiveClient', 'TopBrowsers'},
+                     {'MostPopularBrowser', 'MostActiveClientByDay'},
+                     {'TopPages', 'FastestPage', 'TopClients'}):
+            stat = LogStat(top=3, only=only)
+            stat.add_lines(self.lines[:2500])
+            for line in self.lines[2500:]:
+                stat.add_line(line)
+            self.check(stat, only)
+            self.check(LogStat.load(stat.dump()), only)
+
+        stat = LogStat(only={'MostActiveClientByDay'})
+        stat.add_lines(self.lines)
+        self.assertFalse(stat._pages or stat._clients or stat._browsers)
+        with self.assertRaises(ValueError):
+            LogStat(only={'Percentiles'})
+        with self.assertRaises(ValueError):
+            LogStat(instrument=True, only={'SlowestPage'})
+        with self.assertRaises(ValueError):
+            LogStat(only={'TopPages'})
+
+    def test_pipeline(self):
+        only = {'MostActiveClientByDay'}
+        stat = LogStat(top=3, only=only)
+        stat.add_lines(self.lines[:2500])
+        stat = pickle.loads(pickle.dumps(stat))
+        stat.add_lines(self.lines[2500:])
+        self.check(stat, only)
+        self.assertEqual((stat._pages, stat._clients, stat._browsers),
+                         ({}, {}, {}))
+
+        stat = LogStat(only={'TopPages', 'MostPopularBrowser'}, top=3,
+                       rollups=True)
+        stat.add_lines(self.lines)
+        minutes = stat.results()['RequestsByMinute'].values()
+        self.assertEqual(stat._clients, {})
+        self.assertEqual(sum(requests for requests, _, _ in minutes),
+                         sum(page.count for page in stat._pages.values()))
+
+    def test_merge_and_backends(self):
+        only = {'MostActiveClient', 'SlowestAveragePage'}
+        stat = LogStat(top=3, only=only)
+        stat.add_lines(self.lines[:2000])
+        tail = LogStat(top=3, only=only)
+        tail.add_lines(self.lines[2000:])
+        stat.merge(tail)
+        self.check(stat, only)
+
+        stat = LogStat(top=3, spill=200, only=only)
+        stat.add_lines(self.lines)
+        self.assertGreater(stat.spill.spills, 0)
+        self.check(stat, only)
+
+        if vectorized is not None:
+            stat = vectorized.BatchStat(700, top=3, only={'TopClients'})
+            stat.add_from_buffer(''.join(self.lines).encode())
+            self.check(stat, {'TopClients'})
+            self.assertFalse(stat._pages)
+
+
+class CacheTests(LogFileTestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.cache = ResultCache(self.directory.name, top=3)
+
+    def expected(self, lines):
+        stat = LogStat(top=3)
+        stat.add_from_buffer(''.join(lines).encode())
+        return stat.results()
+
+    def replace_unnoticed(self, i, old, new):
+        """Меняет строку после начала файла, не меняя размер и mtime"""
+        st = os.stat(self.path)
+        lines = list(self.lines)
+        lines[i] = lines[i].replace(old, new)
+        with open(self.path, 'w') as f:
+            f.writelines(lines)
+        os.utime(self.path, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+    def test_unchanged_and_appended(self):
+        self.assertEqual(self.cache.results(self.path),
+                         self.expected(self.lines))
+        # неизменённый по отпечатку файл не разбирается
+        i = len(self.lines) // 2
+        self.assertIn('Agent ', self.lines[i])
+        self.replace_unnoticed(i, 'Agent ', 'Bgent ')
+        self.assertEqual(self.cache.results(self.path),
+                         self.expected(self.lines))
+
+        # у дописанного разбирается только конец, последняя строка - без \n
+        tail = make_log(500, seed=1)
+        tail[-1] = tail[-1][:-1]
+        with open(self.path, 'a') as f:
+            f.writelines(tail)
+        self.assertEqual(self.cache.results(self.path),
+                         self.expected(self.lines + tail))
+        with open(self.path, 'a') as f:
+            f.write('\n')
+        tail[-1] += '\n'
+        self.assertEqual(self.cache.results(self.path),
+                         self.expected(self.lines + tail))
+
+    def test_replaced(self):
+        self.cache.results(self.path)
+        lines = make_log(1000, seed=2)
+        with open(self.path, 'w') as f:
+            f.writelines(lines)
+        self.assertEqual(self.cache.results(self.path),
+                         self.expected(lines))
+        # обрезанный файл с тем же началом разбирается заново
+        with open(self.path, 'w') as f:
+            f.writelines(lines[:500])
+        self.assertEqual(self.cache.results(self.path),
+                         self.expected(lines[:500]))
+        other = ResultCache(self.directory.name, top=1)
+        self.assertEqual(other.results(self.path)['MostPopularPage'],
+                         self.expected(lines[:500])['MostPopularPage'])
+        self.assertNotIn('TopPages', other.results(self.path))
+
+    def test_entry_key(self):
+        # ключ не зависит от адресов объектов и порядка множеств
+        def cache(**options):
+            return ResultCache(self.directory.name, **options)
+
+        def normalizer(keep):
+            return Normalizer(keep, prefixes={'/api': ('q',)})
+
+        only = {'MostPopularPage', 'TopPages', 'MostActiveClient'}
+        path = cache(normalize=normalizer(['a', 'b']),
+                     only=only).entry_path(self.path)
+        self.assertEqual(cache(only=set(sorted(only, reverse=True)),
+                               normalize=normalizer(('b', 'a'))
+                               ).entry_path(self.path), path)
+        self.assertEqual(cache(only=only)._key,
+                         ('dict', [('only', ('set', sorted(only)))]))
+        self.assertNotEqual(cache(normalize=normalizer(['a']), only=only)
+                            .entry_path(self.path), path)
+        with self.assertRaises(ValueError):
+            cache(normalize=object())
+
+
+class FollowTests(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'access.log')
+        self.state = os.path.join(self.dir.name, 'state')
+        self.lines = make_log(600, seed=2)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def write(self, text, mode='a'):
+        with open(self.path, mode) as f:
+            f.write(text)
+
+    def test_resume_from_checkpoint(self):
+        self.write(''.join(self.lines[:200]) + self.lines[200][:30])
+        follower = LogFollower(self.path, self.state)
+        follower.poll()
+        follower.checkpoint()
+        follower.close()
+        self.assertEqual(follower.stat.results(),
+                         stat_of(self.lines[:200]).results())
+
+        self.write(self.lines[200][30:] + ''.join(self.lines[201:]))
+        follower = LogFollower(self.path, self.state)
+        follower.poll()
+        follower.close()
+        self.assertEqual(follower.stat.results(),
+                         stat_of(self.lines).results())
+
+    def test_rotation(self):
+        self.write(''.join(self.lines[:300]))
+        follower = LogFollower(self.path, self.state)
+        follower.poll()
+        self.write(''.join(self.lines[300:400]))
+        os.rename(self.path, self.path + '.1')
+        self.write(''.join(self.lines[400:]))
+        follower.poll()
+        follower.close()
+        self.assertEqual(follower.stat.results(),
+                         stat_of(self.lines).results())
+
+    def test_truncation(self):
+        self.write(''.join(self.lines[:300]))
+        follower = LogFollower(self.path, self.state)
+        follower.poll()
+        self.write(''.join(self.lines[300:350]), 'w')
+        follower.poll()
+        follower.close()
+        self.assertEqual(follower.stat.results(),
+                         stat_of(self.lines[:350]).results())
+
+    def test_copytruncate(self):
+        # после обрезки до опроса дописали больше, чем было прочитано
+        self.write(''.join(self.lines[:100]))
+        follower = LogFollower(self.path, self.state)
+        follower.poll()
+        self.write(''.join(self.lines[100:400]), 'w')
+        follower.poll()
+        follower.close()
+        self.assertEqual(follower.stat.results(),
+                         stat_of(self.lines[:400]).results())
+
+
+if __name__ == '__main__':
+    unittest.main()
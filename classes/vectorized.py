@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+import sys
+import pprint
+
+import numpy as np
+
+from hw5_stripped import LogStat, bytes_pattern, field_names, \
+    line_spans, req_time_value
+from quantiles import QuantileSketch
+from hll import HyperLogLog
+
+
+def encode(column, decode=None):
+    """Номера значений столбца в порядке первой встречи и список значений.
+    Если задан `decode`, значения декодируются, и совпавшие после
+    декодирования получают один номер"""
+    uniques = list(dict.fromkeys(column))
+    ids = dict(zip(uniques, range(len(uniques))))
+    column = np.fromiter(map(ids.__getitem__, column), np.int64, len(column))
+    if decode is None:
+        return column, uniques
+
+    values = {}  # {значение: номер, ...}
+    renumber = [values.setdefault(value, len(values))
+                for value in map(decode, uniques)]
+    if len(values) != len(uniques):
+        column = np.array(renumber, dtype=np.int64)[column]
+    return column, list(values)
+
+
+def decode_bytes(value):
+    return value.decode('utf-8', 'surrogateescape')
+
+
+class BatchStat(LogStat):
+    """LogStat, который копит разобранные строки блоками по `block_size`
+    строк и считает блок по столбцам номеров средствами numpy. Таблицы
+    блока складываются в статистику так же, как в `merge`, поэтому
+    результаты совпадают с построчным подсчётом"""
+
+    def __init__(self, block_size=1 << 16, **options):
+        super().__init__(**options)
+        if self.instrument is not None:
+            raise ValueError('BatchStat does not support instrument')
+        if self.spill is not None:
+            raise ValueError('BatchStat does not support spill')
+        self.block_size = block_size
+        self._rows = []  # [(ip, date, clock, name, code, agent, req_t), ...]
+        self._raw = False  # в блоке байтовые поля и время вместо даты
+
+    def _install_pipeline(self):
+        super()._install_pipeline()
+        del self._add  # строки копятся в блок, лишнее не считает блок
+
+    def _add(self, ip, date, clock, name, code, agent, req_time):
+        if self._raw:
+            self.flush()
+        self._rows.append((ip, date, clock, name, code, agent, req_time))
+        if len(self._rows) >= self.block_size:
+            self.flush()
+
+    def add_from_buffer(self, buf, start=0, end=None):
+        """Как `LogStat.add_from_buffer`, но строки блока копятся байтами и
+        декодируются при подсчёте блока, по разу на значение"""
+        if self.rollup is not None or self.windows is not None or \
+                self.sessions is not None or self.log_format is not None:
+            return super().add_from_buffer(buf, start, end)
+        if not self._raw:
+            self.flush()
+            self._raw = True
+
+        rows = self._rows
+        block_size = self.block_size
+        match = bytes_pattern.match
+        for pos, eol in line_spans(buf, start, end):
+            log = match(buf, pos, eol)
+            if not log:
+                continue
+
+            rows.append(log.group(*field_names))
+            if len(rows) >= block_size:
+                self.flush()
+                self._raw = True
+                rows = self._rows
+
+    def flush(self):
+        """Досчитывает накопленный блок"""
+        if self._rows:
+            self._merge_block()
+        self._rows = []
+        self._raw = False
+
+    def _merge_block(self):
+        """Складывает таблицы блока прямо в статистику, как `merge`: лидеры
+        обновляются только по ключам блока"""
+        ip_col, date_col, clock_col, name_col, code_col, agent_col, \
+            req_col = zip(*self._rows)
+        if self._raw:
+            if self.normalizer is None:
+                pages, page_names = encode(name_col, decode_bytes)
+            else:
+                normalize = self.normalizer.normalize
+                pages, page_names = encode(name_col, lambda name: normalize(
+                    decode_bytes(name)))
+            ips, ip_names = encode(ip_col, decode_bytes)
+            agents, agent_names = encode(agent_col, decode_bytes)
+            days, dates = encode(date_col, lambda time: self._get_date(
+                time.decode('ascii')))
+        else:
+            pages, page_names = encode(name_col)
+            ips, ip_names = encode(ip_col)
+            agents, agent_names = encode(agent_col)
+            days, dates = encode(date_col)
+        req_ids, req_times = encode(req_col, req_time_value)
+        req_times = np.array(req_times, dtype=np.int64)[req_ids]
+
+        if self._need_pages:
+            timed = req_times >= 0
+            self._merge_pages(page_names, pages, pages[timed],
+                              req_times[timed])
+        if self._need_browsers:
+            self._merge_browsers(zip(agent_names, np.bincount(
+                agents, minlength=len(agent_names)).tolist()))
+        if self._need_clients:
+            self._merge_clients(zip(ip_names, np.bincount(
+                ips, minlength=len(ip_names)).tolist()))
+        if self._need_days:
+            self._merge_days(dates, ip_names, ips, days)
+
+        if self.distinct_clients:
+            self._merge_visitors(dates, page_names, ip_names, pages, ips,
+                                 days)
+        # дополнительная статистика получает строки блока по порядку
+        if self.rollup is not None:
+            for date, clock, code, req_time in zip(date_col, clock_col,
+                                                   code_col, req_col):
+                self.rollup.add(date, clock, code, req_time)
+        if self.windows is not None:
+            for date, clock, name, ip, req_time in zip(
+                    date_col, clock_col, name_col, ip_col, req_col):
+                self.windows.add(date, clock, name, ip, req_time)
+        if self.sessions is not None:
+            for date, clock, ip in zip(date_col, clock_col, ip_col):
+                self.sessions.add(date, clock, ip)
+
+    def _merge_pages(self, names, pages, timed_pages, timed_values):
+        size = len(names)
+        counts = np.bincount(pages, minlength=size).tolist()
+        sums = np.zeros(size, dtype=np.int64)
+        np.add.at(sums, timed_pages, timed_values)
+        fastest = np.full(size, np.iinfo(np.int64).max)
+        np.minimum.at(fastest, timed_pages, timed_values)
+        slowest = np.full(size, -1)
+        np.maximum.at(slowest, timed_pages, timed_values)
+        last = np.full(size, -1)
+        np.maximum.at(last, timed_pages,
+                      np.arange(1, len(timed_pages) + 1))
+
+        table = self._pages
+        merged = []  # страницы статистики в порядке номеров блока
+        for name, count, total, fast, slow, last_line in zip(
+                names, counts, sums.tolist(), fastest.tolist(),
+                slowest.tolist(), last.tolist()):
+            page = table.get(name)
+            if page is None:
+                page = table[name] = self.page_class(
+                    name, None, self.num,
+                    QuantileSketch() if self.percentiles else None)
+                self.num += 1
+                page.count = count
+                page.req_times = total
+                if last_line != -1:
+                    page.avg = total / count
+            else:
+                page.count += count
+                page.req_times += total
+                page.avg = page.req_times / page.count
+            if last_line != -1:
+                if page.fast_req_t is None or fast < page.fast_req_t:
+                    page.fast_req_t = fast
+                if page.slow_req_t is None or slow > page.slow_req_t:
+                    page.slow_req_t = slow
+                page.last = self.timed + last_line
+            merged.append(page)
+
+        if self.percentiles:
+            for page, value in zip(timed_pages.tolist(),
+                                   timed_values.tolist()):
+                merged[page].sketch.add(value)
+        self.timed += len(timed_values)
+        for page in merged:
+            self._upd_merged_page(page)
+
+    def _merge_days(self, dates, ip_names, ips, days):
+        # пары (день, клиент) в порядке первой встречи
+        pairs, first, counts = np.unique(days * len(ip_names) + ips,
+                                         return_index=True,
+                                         return_counts=True)
+        order = np.argsort(first, kind='stable')
+        block_days = {}  # {date: [(ip, count), ...], ...}
+        for pair, count in zip(pairs[order].tolist(),
+                               counts[order].tolist()):
+            block_days.setdefault(dates[pair // len(ip_names)], []).append(
+                (ip_names[pair % len(ip_names)], count))
+        for date, counts in block_days.items():
+            self._merge_day(date, counts)
+
+    def _merge_visitors(self, dates, page_names, ip_names, pages, ips,
+                        days):
+        hashes = [HyperLogLog.hash(ip) for ip in ip_names]
+        page_hlls = []
+        for name in page_names:
+            page = self._pages[name]
+            if page.visitors is None:
+                page.visitors = HyperLogLog(self.page_hll_precision)
+            page_hlls.append(page.visitors)
+        day_hlls = []
+        for date in dates:
+            day_hlls.append(self._day_visitors.setdefault(
+                date, HyperLogLog(self.day_hll_precision)))
+        for page, ip, day in zip(pages.tolist(), ips.tolist(),
+                                 days.tolist()):
+            page_hlls[page].add_hash(hashes[ip])
+            day_hlls[day].add_hash(hashes[ip])
+
+    def merge(self, other):
+        self.flush()
+        if isinstance(other, BatchStat):
+            other.flush()
+        super().merge(other)
+
+    def dump(self):
+        self.flush()
+        return super().dump()
+
+    def results(self):
+        self.flush()
+        if self._is_empty():
+            self.add_from_stdin()
+            self.flush()
+        return super().results()
+
+
+if __name__ == '__main__':
+    pprint.pprint(BatchStat().results() if len(sys.argv) < 2 else
+                  BatchStat(int(sys.argv[1])).results())
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+import datetime
+
+epoch = datetime.date(1970, 1, 1).toordinal()
+
+
+def minute_of(date, clock):
+    """Номер минуты с 1970 года по дате и времени из лога (минута
+    разбирается так же, как в Rollup) или None"""
+    try:
+        hour, minute = int(clock[:2]), int(clock[3:5])
+    except ValueError:
+        return None
+    if not (0 <= hour < 24 and 0 <= minute < 60):
+        return None
+    return (date.toordinal() - epoch) * 1440 + hour * 60 + minute
+
+
+class Bucket:
+    __slots__ = ('minute', 'pages', 'clients')
+
+    def __init__(self, minute):
+        self.minute = minute
+        self.pages = {}  # {name: [count, timed, req_times], ...}
+        self.clients = {}  # {ip: count, ...}
+
+
+class Window:
+    """Статистика за последние `minutes` минут: кольцо из корзин по минутам
+    и суммы по всем корзинам кольца. Когда минута выходит из окна, её
+    корзина вычитается из сумм"""
+
+    def __init__(self, minutes):
+        self.minutes = minutes
+        self.ring = [None] * minutes  # [Bucket или None, ...]
+        self.end = None  # последняя минута окна
+        self.pages = {}  # {name: [count, timed, req_times], ...}
+        self.clients = {}  # {ip: count, ...}
+
+    def _advance(self, minute):
+        if self.end is not None:
+            for step in range(1, min(minute - self.end, self.minutes) + 1):
+                self._expire((self.end + step) % self.minutes)
+        self.end = minute
+
+    def _expire(self, slot):
+        bucket = self.ring[slot]
+        if bucket is None:
+            return
+        self.ring[slot] = None
+        for name, (count, timed, req_times) in bucket.pages.items():
+            total = self.pages[name]
+            if total[0] == count:
+                del self.pages[name]
+            else:
+                total[0] -= count
+                total[1] -= timed
+                total[2] -= req_times
+        for ip, count in bucket.clients.items():
+            if self.clients[ip] == count:
+                del self.clients[ip]
+            else:
+                self.clients[ip] -= count
+
+    def _bucket(self, minute):
+        """Корзина минуты или None, если минута уже вне окна"""
+        if self.end is None or minute > self.end:
+            self._advance(minute)
+        elif minute <= self.end - self.minutes:
+            return None
+        slot = minute % self.minutes
+        bucket = self.ring[slot]
+        if bucket is None:
+            bucket = self.ring[slot] = Bucket(minute)
+        return bucket
+
+    def add(self, minute, name, ip, req_time):
+        bucket = self._bucket(minute)
+        if bucket is None:
+            return
+        timed = 1 if req_time else 0
+        req_time = int(req_time) if req_time else 0
+
+        for pages in (bucket.pages, self.pages):
+            if name in pages:
+                page = pages[name]
+                page[0] += 1
+                page[1] += timed
+                page[2] += req_time
+            else:
+                pages[name] = [1, timed, req_time]
+        for clients in (bucket.clients, self.clients):
+            if ip in clients:
+                clients[ip] += 1
+            else:
+                clients[ip] = 1
+
+    def merge(self, other):
+        if other.end is None:
+            return
+        for bucket in other.ring:
+            if bucket is None:
+                continue
+            mine = self._bucket(bucket.minute)
+            if mine is None:
+                continue
+            for name, values in bucket.pages.items():
+                for pages in (mine.pages, self.pages):
+                    if name in pages:
+                        pages[name] = [a + b for a, b in
+                                       zip(pages[name], values)]
+                    else:
+                        pages[name] = list(values)
+            for ip, count in bucket.clients.items():
+                for clients in (mine.clients, self.clients):
+                    clients[ip] = clients.get(ip, 0) + count
+
+    def results(self):
+        """Лидеры окна; при равенстве - лексикографически меньшее имя"""
+        slowest = None
+        if any(timed for _, timed, _ in self.pages.values()):
+            slowest = min(
+                (name for name, (_, timed, _) in self.pages.items() if timed),
+                key=lambda name: (-self.pages[name][2] / self.pages[name][0],
+                                  name))
+        return {
+            'SlowestAveragePage': slowest,
+            'MostPopularPage': min(
+                self.pages, key=lambda name: (-self.pages[name][0], name),
+                default=None),
+            'MostActiveClient': min(
+                self.clients, key=lambda ip: (-self.clients[ip], ip),
+                default=None)
+        }
+
+
+class SlidingWindows:
+    """Окна на несколько длин (в минутах). Минута строки запоминается для
+    последних даты и префикса времени, как в Rollup"""
+
+    def __init__(self, sizes):
+        self.windows = {minutes: Window(minutes) for minutes in sizes}
+        self._date = None
+        self._prefix = None
+        self._minute = None
+
+    def add(self, date, clock, name, ip, req_time):
+        if clock[:5] != self._prefix or date != self._date:
+            self._date = date
+            self._prefix = clock[:5]
+            self._minute = minute_of(date, self._prefix)
+        if self._minute is None:
+            return
+        for window in self.windows.values():
+            window.add(self._minute, name, ip, req_time)
+
+    def add_minute(self, minute, name, ip, req_time):
+        for window in self.windows.values():
+            window.add(minute, name, ip, req_time)
+
+    def merge(self, other):
+        for minutes, window in self.windows.items():
+            window.merge(other.windows[minutes])
+        self._prefix = None
+
+    def results(self):
+        """{длина окна: лидеры окна, ...}"""
+        return {minutes: window.results()
+                for minutes, window in self.windows.items()}
@@ -11,7 +11,7 @@ re_code = r'\d{3}'
 re_weight = r'\d*'
 re_referrer = r'".*"'
 re_user_agent = r'.*'
-re_request_time = r'( \d*)?'
+re_request_time = r'( \d+)?'
 pattern = re.compile(' '.join([
     r'(?P<ip>' + re_ip + r')',
     r'-\s-',
@@ -25,6 +25,9 @@ pattern = re.compile(' '.join([
 
 
 class Page:
+    __slots__ = ('name', 'count', 'fast_req_t', 'slow_req_t', 'req_times',
+                 'avg', 'num')
+
     def __init__(self, name, req_time):
         self.name = name
         self.count = 1